@@ -4,65 +4,573 @@ Date: 3/30/2023
 Purpose: This script is a template for all Five9 Python automation scripts. It contains all the necessary imports and constants to get started.
 """
 
-import requests
-import csv
+from __future__ import annotations #annotations such as etree._Element are not evaluated, so they do not import lxml
+import importlib
+import copy
+import contextlib
+import traceback
 import sys
 import json
 import os
-import xml.etree.ElementTree as ET
-import lxml.etree as etree
-import xmltodict
-from requests.auth import HTTPBasicAuth
-from getpass import getpass
+import io
+import re
+import threading
+import time
+import random
+import hashlib
+import gzip
+from datetime import datetime, timezone
+from collections import deque, defaultdict
 import click
-from dotenv import load_dotenv
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used"""
+    def __init__(self, name) -> None:
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+#Heavy dependencies are only imported once a command needs them, so --help and argument errors return quickly
+requests = LazyModule("requests")
+requests_adapters = LazyModule("requests.adapters")
+requests_auth = LazyModule("requests.auth")
+etree = LazyModule("lxml.etree")
+xmltodict = LazyModule("xmltodict")
+csv = LazyModule("csv")
+dotenv = LazyModule("dotenv")
+getpass = LazyModule("getpass")
+concurrent_futures = LazyModule("concurrent.futures")
+email_utils = LazyModule("email.utils")
+saxutils = LazyModule("xml.sax.saxutils")
+sqlite3 = LazyModule("sqlite3")
 
 #Constants
-URL_REST = "https://api.five9.com/restadmin/api/v1/domains" #This is the base URL for all REST API calls
-URL_SOAP = "https://api.five9.com:443/wsadmin/v12/AdminWebService" #This is the base URL for all SOAP API calls
+URL_REST = os.environ.get("VCC-REST-URL", "https://api.five9.com/restadmin/api/v1/domains") #This is the base URL for all REST API calls
+URL_SOAP = os.environ.get("VCC-SOAP-URL", "https://api.five9.com:443/wsadmin/v12/AdminWebService") #This is the base URL for all SOAP API calls
 LOGGING = True
 RESULTSMAX = 100
+POOL_SIZE = 10 #Number of keep-alive connections held open to api.five9.com
+DEFAULT_HEADERS = {"Connection": "keep-alive", "User-Agent": "Five9-Python-VCC-Tools", "Accept-Encoding": "gzip, deflate"}
+REST_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+SOAP_HEADERS = {"Content-Type": "text/xml;charset=UTF-8"}
+WORKERS = 8 #Default number of entities processed at once by domain wide commands
+PREFETCH_PAGES = 4 #Number of list pages requested ahead of the one being processed
+IVR_BATCH_SIZE = 25 #Maximum number of scripts fetched by a single getIVRScripts call
+IVR_PATTERN_MAX = 4000 #Maximum length of the namePattern sent in a single getIVRScripts call
+DOMAIN_PROCESSES = 8 #Default number of domains worked on at once by --domains
+DOMAINS_DIR = "Domains" #Each domain run by --domains works in its own folder under this one
+STREAM_CHUNK = 64 * 1024 #Number of response bytes handed to the xml parser at a time
+COMPRESS_MIN_BYTES = 16 * 1024 #modifyIVRScript bodies at least this large are sent gzip compressed when the API accepts it
+COMPRESS_LEVEL = 6
+COMPRESS_REJECTED = ("content-encoding", "gzip", "unsupported media type", "content is not allowed in prolog", "invalid byte",
+                     "start tag expected", "unexpected character") #Error text showing a server read a compressed body as plain xml
+BACKUP_DIR = "IVR Backups"
+FAILED_DIR = "Failed Updates" #Definitions that could not be uploaded are saved here, ivr replay sends them again
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".five9-vcc-tools") #Local state shared by every invocation of the tool
+SNAPSHOT_KINDS = ("skills", "prompts", "call_variables", "campaigns", "scripts") #Tables written by the snapshot command
+DOMAIN_CACHE_TTL = 24 * 60 * 60 #Seconds a cached domain id/name is trusted before getVCCConfiguration is called again
+RETRY_ATTEMPTS = 4 #Maximum number of times a single API call is sent
+RETRY_STATUSES = (500, 502, 503, 504) #Responses worth retrying for idempotent calls, 429 is always retried
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+IDEMPOTENT_SOAP_OPERATIONS = ("getVCCConfiguration", "getIVRScripts", "modifyIVRScript") #modifyIVRScript replaces the whole definition
+CIRCUIT_THRESHOLD = 10 #Consecutive server errors or connection failures that open the circuit
+CIRCUIT_COOLDOWN = 30 #Seconds calls fail immediately before a single trial call is let through
+RETRY_BASE_DELAY = 0.5 #Seconds, doubled after every failed attempt before jitter is applied
+RETRY_MAX_DELAY = 8
+LIMIT_INITIAL = 4 #Requests allowed in flight before the adaptive limit has seen any responses
+LIMIT_DECREASE = 0.5 #Factor the limit is multiplied by when the API throttles or fails
+LATENCY_TOLERANCE = 2 #The limit only grows while latency stays within this factor of its running average
+PROFILE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5) #Upper bounds in seconds of the latency histogram printed by --profile
+
+UNCHANGED = "unchanged" #Returned by operations that found nothing to change and skipped the upload
+NOT_ATTEMPTED = "not attempted" #Recorded by run_bulk for items left once the API was found to be down
+RESUMED = "done in an earlier run" #Recorded by run_bulk for items a resumed run found finished in its journal
+
+#Set by cli(), defaults apply when the classes are used without the command line
+VERBOSE = False
+DEBUG = False
+REFRESH_DOMAIN = False
+PROFILER = None #Five9Profiler recording every API call when --profile is given
+BULK_SUMMARIES = [] #Totals printed by print_bulk_summary, returned to the parent process when running across domains
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit shared by every call made through a Five9Session
+
+    The number of requests allowed in flight grows by one per window of healthy responses and is cut
+    by LIMIT_DECREASE whenever the API answers 429 or 5xx or the connection fails. A Retry-After header
+    pauses every caller until it has passed.
+    """
+    def __init__(self, maximum=POOL_SIZE, initial=LIMIT_INITIAL, minimum=1) -> None:
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.paused_until = 0
+        self.latency = None #exponentially weighted average latency of healthy responses
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """blocks until a request may be sent"""
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, status, latency, retry_after=None):
+        """
+        Records the outcome of a request sent after acquire
+
+        :param status: http status code or None if the connection failed
+        :param latency: seconds until the response headers arrived
+        :param retry_after: seconds the API asked callers to wait, if any
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if status is None or status == 429 or status >= 500:
+                self.limit = max(self.minimum, self.limit * LIMIT_DECREASE)
+                if DEBUG:
+                    click.echo(f"Throttling: {status}, concurrency limit is now {int(self.limit)}")
+            else:
+                if self.latency is None or latency <= self.latency * LATENCY_TOLERANCE:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.condition.notify_all()
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the API is considered down"""
+
+class ListingError(Exception):
+    """Raised when a page of a REST list could not be retrieved, so a short list is never mistaken for a complete one"""
+
+class CircuitBreaker:
+    """
+    Fails calls immediately once CIRCUIT_THRESHOLD consecutive calls have hit server errors
+
+    After CIRCUIT_COOLDOWN seconds one trial call is let through, its outcome closes the circuit again
+    or restarts the cooldown. This keeps a bulk run from grinding through thousands of doomed requests.
+    """
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False #True while the single trial call of a half open circuit is in flight
+        self.lock = threading.Lock()
+
+    def check(self):
+        """raises CircuitOpenError if a call may not be sent now"""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f"Five9 API unavailable after {self.failures} consecutive failures")
+            self.trial = True
+
+    def record(self, success):
+        with self.lock:
+            self.trial = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None and (DEBUG or VERBOSE):
+                    click.echo(f"Error: {self.failures} consecutive API failures, pausing calls for {self.cooldown}s")
+                self.opened_at = time.monotonic()
+
+def is_soap_fault(response):
+    """True if the response is a SOAP fault, the admin web service reports those with status 500"""
+    if response.status_code != 500 or "xml" not in response.headers.get("Content-Type", ""):
+        return False
+    return b"Fault>" in response.content
+
+def parse_retry_after(response):
+    """returns the seconds requested by a Retry-After header or None"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (email_utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def encoding_rejected(response) -> bool:
+    """True if a failed response shows the server could not read a compressed request body"""
+    if response.status_code == 415:
+        return True
+    if response.status_code not in (400, 500):
+        return False
+    text = response.text.lower()
+    return any(marker in text for marker in COMPRESS_REJECTED)
+
+def body_size(data):
+    """returns the number of bytes in a request body"""
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, io.BytesIO):
+        return data.getbuffer().nbytes
+    return 0
+
+class Five9Profiler:
+    """
+    Records every API call made through a Five9Session and the time spent parsing and serializing
+
+    Calls are grouped by operation, the SOAP operation or the REST method and path with ids replaced.
+    Bodies of streamed responses are read while they are parsed, so their download time and size are
+    counted in the parse phase rather than the call.
+
+    :param trace_path: file every call is appended to as a line of JSON, if given
+    """
+    def __init__(self, trace_path=None) -> None:
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.calls = defaultdict(lambda: {"count": 0, "errors": 0, "retries": 0, "sent": 0, "received": 0,
+                                          "network": 0.0, "elapsed": 0.0, "latencies": []})
+        self.phases = defaultdict(lambda: [0, 0.0]) #phase -> [count, seconds]
+        self.trace = open(trace_path, "w") if trace_path else None
+
+    def record_call(self, operation, endpoint, status, sent, received, network, elapsed, retries):
+        """
+        Records a single API call once its final attempt has finished
+
+        :param status: http status of the final attempt or None if the connection failed
+        :param received: response bytes or None if the body is streamed
+        :param network: seconds spent waiting for responses, summed over every attempt
+        :param elapsed: seconds from the first attempt to the final response, including backoff
+        """
+        with self.lock:
+            call = self.calls[operation]
+            call["count"] += 1
+            call["errors"] += status is None or status >= 400
+            call["retries"] += retries
+            call["sent"] += sent
+            call["received"] += received or 0
+            call["network"] += network
+            call["elapsed"] += elapsed
+            call["latencies"].append(network / (retries + 1))
+            if self.trace:
+                self.trace.write(json.dumps({"time": round(time.perf_counter() - self.started, 6), "operation": operation,
+                                             "endpoint": endpoint, "status": status, "bytes_sent": sent,
+                                             "bytes_received": received, "latency": round(network, 6),
+                                             "elapsed": round(elapsed, 6), "retries": retries}) + "\n")
+
+    def record_phase(self, phase, seconds):
+        with self.lock:
+            self.phases[phase][0] += 1
+            self.phases[phase][1] += seconds
+
+    def close(self):
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+    def report(self):
+        """prints the per operation summary, latency histograms and the time split"""
+        wall = time.perf_counter() - self.started
+        with self.lock:
+            calls = dict(self.calls)
+            phases = dict(self.phases)
+        total = sum(call["count"] for call in calls.values())
+        click.echo(f"\nProfile: {total} API calls in {wall:.2f}s, {sum(call['retries'] for call in calls.values())} retries", err=True)
+        if not calls:
+            return
+        width = max(len(operation) for operation in calls)
+        click.echo(f"  {'operation':<{width}}  {'calls':>6} {'errors':>6} {'retries':>7} {'sent':>9} {'received':>9} "
+                   f"{'p50':>8} {'p95':>8} {'max':>8}", err=True)
+        for operation, call in sorted(calls.items(), key=lambda item: -item[1]["network"]):
+            latencies = sorted(call["latencies"])
+            click.echo(f"  {operation:<{width}}  {call['count']:>6} {call['errors']:>6} {call['retries']:>7} "
+                       f"{format_bytes(call['sent']):>9} {format_bytes(call['received']):>9} "
+                       f"{format_ms(percentile(latencies, 0.5)):>8} {format_ms(percentile(latencies, 0.95)):>8} "
+                       f"{format_ms(latencies[-1]):>8}", err=True)
+
+        labels = [f"<{format_ms(bound)}" for bound in PROFILE_BUCKETS] + [f">={format_ms(PROFILE_BUCKETS[-1])}"]
+        click.echo(f"\n  Latency histogram\n  {'operation':<{width}}  " + " ".join(f"{label:>7}" for label in labels), err=True)
+        for operation, call in sorted(calls.items()):
+            buckets = [0] * len(labels)
+            for latency in call["latencies"]:
+                buckets[next((i for i, bound in enumerate(PROFILE_BUCKETS) if latency < bound), len(PROFILE_BUCKETS))] += 1
+            click.echo(f"  {operation:<{width}}  " + " ".join(f"{count or '':>7}" for count in buckets), err=True)
+
+        #summed across threads, so with concurrent workers these add up to more than the wall time
+        network = sum(call["network"] for call in calls.values())
+        waiting = sum(call["elapsed"] - call["network"] for call in calls.values()) #limiter queue and retry delays
+        split = [f"network {network:.2f}s", f"queued or backing off {waiting:.2f}s"]
+        split += [f"{phase} {seconds:.2f}s ({count})" for phase, (count, seconds) in sorted(phases.items())]
+        click.echo(f"\n  Time across all threads: {', '.join(split)}", err=True)
+
+@contextlib.contextmanager
+def profiled(phase):
+    """times the block as the given phase when --profile is on"""
+    if PROFILER is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PROFILER.record_phase(phase, time.perf_counter() - start)
+
+def percentile(values, fraction):
+    """returns the value at fraction of the way through the sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:g}s"
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+class Five9Session:
+    """Connection pooled transport shared by the agent and every entity it creates"""
+    def __init__(self, auth, pool_size=POOL_SIZE, headers=None, url_rest=URL_REST, url_soap=URL_SOAP, profiler=None) -> None:
+        self.auth = auth
+        self.profiler = profiler or PROFILER
+        self.pool_size = pool_size
+        self.url_rest = url_rest
+        self.url_soap = url_soap
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update(DEFAULT_HEADERS)
+        if headers:
+            self.session.headers.update(headers)
+        #one pool per host, sized so concurrent callers never have to open throwaway connections
+        adapter = requests_adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = AdaptiveLimiter(maximum=pool_size)
+        self.breaker = CircuitBreaker()
+        self.compress_requests = None #whether the API accepts gzip request bodies, None until a compressed call has been answered
+        self.compress_lock = threading.Lock() #held by the one compressed call that finds out
+
+    def request(self, method, url, headers=None, data=None, idempotent=None, operation=None, **kwargs):
+        """
+        Sends a request over the pooled session and returns the response
+
+        Every attempt waits for the limiter and goes through the circuit breaker. Throttled (429) requests
+        are always sent again. 5xx responses and connection errors are retried only for idempotent calls,
+        with exponential jittered delays, so a POST that creates something is never sent twice.
+
+        :param idempotent: whether the call is safe to repeat, defaults to the rules for the http method
+        :param operation: name the call is recorded under by the profiler, defaults to the method and path
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not self.profiler:
+            return self.send(method, url, headers, data, idempotent, **kwargs)
+        endpoint = self.endpoint(url)
+        outcome = {"response": None, "network": 0.0, "attempts": 0}
+        start = time.monotonic()
+        try:
+            response = self.send(method, url, headers, data, idempotent, outcome, **kwargs)
+        finally:
+            response = outcome["response"]
+            received = None
+            if response is not None:
+                #bytes on the wire, compressed responses are smaller than their content
+                if response.headers.get("Content-Length", "").isdigit():
+                    received = int(response.headers["Content-Length"])
+                elif not kwargs.get("stream"):
+                    received = len(response.content)
+            self.profiler.record_call(operation or f"{method.upper()} {endpoint}", endpoint,
+                                      None if response is None else response.status_code, body_size(data), received,
+                                      outcome["network"], time.monotonic() - start, max(0, outcome["attempts"] - 1))
+        return response
+
+    def send(self, method, url, headers, data, idempotent, outcome=None, **kwargs):
+        """the retry loop behind request, outcome collects the final response and network time for the profiler"""
+        outcome = {"response": None, "network": 0.0, "attempts": 0} if outcome is None else outcome
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            self.breaker.check()
+            if hasattr(data, "seek"):
+                data.seek(0) #streamed bodies are read again when a request is resent
+            self.limiter.acquire()
+            outcome["attempts"] = attempt
+            outcome["response"] = None
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, data=data, **kwargs)
+            except requests.exceptions.RequestException as e:
+                outcome["network"] += time.monotonic() - start
+                self.limiter.release(None, time.monotonic() - start)
+                self.breaker.record(False)
+                if not idempotent or attempt == RETRY_ATTEMPTS:
+                    raise
+                self.wait_to_retry(method, url, attempt, str(e))
+                continue
+            outcome["response"] = response
+            outcome["network"] += time.monotonic() - start
+            #the API sends utf-8, without a declared charset requests would assume latin-1 for text/xml or sniff the body
+            if "charset" not in response.headers.get("Content-Type", "").lower():
+                response.encoding = "utf-8"
+            #streamed bodies are still being read after this point, the limit covers the wait for the server
+            retry_after = parse_retry_after(response) if response.status_code in (429, 503) else None
+            #a SOAP fault is the service rejecting the request, not the service being down
+            status = 400 if is_soap_fault(response) else response.status_code
+            self.limiter.release(status, time.monotonic() - start, retry_after)
+            self.breaker.record(status < 500)
+            #a throttled request was never processed so it is safe to send again whatever the method
+            retry = status == 429 or (idempotent and status in RETRY_STATUSES)
+            if not retry or attempt == RETRY_ATTEMPTS:
+                return response
+            response.close()
+            self.wait_to_retry(method, url, attempt, f"{response.status_code} {response.reason}", retry_after)
+
+    def endpoint(self, url):
+        """returns the path of a url with the domain and entity ids replaced so calls can be grouped"""
+        if url.startswith(self.url_soap):
+            return "SOAP"
+        path = url[len(self.url_rest):] if url.startswith(self.url_rest) else url
+        parts = path.split("?")[0].split("/")
+        for i, part in enumerate(parts):
+            if i == 1 and part:
+                parts[i] = "{domain}"
+            elif part.isdigit():
+                parts[i] = "{id}"
+        return "/".join(parts)
+
+    def wait_to_retry(self, method, url, attempt, reason, retry_after=None):
+        if DEBUG:
+            click.echo(f"Retrying {method} {url} after attempt {attempt}: {reason}")
+        if retry_after is None: #otherwise the limiter holds every caller until Retry-After has passed
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))))
+
+    def rest(self, method, path, headers=None, **kwargs):
+        """sends a request to the REST api, path is relative to URL_REST"""
+        return self.request(method, f"{self.url_rest}{path}", headers={**REST_HEADERS, **(headers or {})}, **kwargs)
+
+    def soap(self, payload, operation=None, headers=None, compress=False, **kwargs):
+        """
+        Posts a SOAP envelope to the admin web service
+
+        :param operation: name of the SOAP operation, used by the retry rules and the profiler
+        :param compress: sends large payloads gzip compressed unless the API has already rejected a compressed body
+        """
+        headers = {**SOAP_HEADERS, **(headers or {})}
+        idempotent = operation in IDEMPOTENT_SOAP_OPERATIONS
+        if compress and self.compress_requests is not False and body_size(payload) >= COMPRESS_MIN_BYTES:
+            if self.compress_requests is None:
+                #the first compressed call finds out if the API accepts them while every other one waits
+                with self.compress_lock:
+                    if self.compress_requests is None:
+                        return self.probe_compressed(payload, operation, headers, idempotent, **kwargs)
+            if self.compress_requests:
+                return self.soap_compressed(payload, operation, headers, idempotent, **kwargs)
+        return self.request("POST", self.url_soap, headers=headers, data=payload,
+                            idempotent=idempotent, operation=f"SOAP {operation or 'call'}", **kwargs)
+
+    def soap_compressed(self, payload, operation, headers, idempotent, **kwargs):
+        with profiled("serialize"):
+            compressed = gzip.compress(payload.getvalue() if isinstance(payload, io.BytesIO) else
+                                       payload.encode("utf-8") if isinstance(payload, str) else payload, COMPRESS_LEVEL, mtime=0)
+        return self.request("POST", self.url_soap, headers={**headers, "Content-Encoding": "gzip"}, data=compressed,
+                            idempotent=idempotent, operation=f"SOAP {operation} gzip", **kwargs)
+
+    def probe_compressed(self, payload, operation, headers, idempotent, **kwargs):
+        """sends a call compressed and, only if the compression itself was rejected, again uncompressed"""
+        response = self.soap_compressed(payload, operation, headers, idempotent, **kwargs)
+        if response.status_code == 200:
+            self.compress_requests = True
+            return response
+        if not encoding_rejected(response):
+            #a real fault such as an invalid script, the next compressed call finds out instead
+            return response
+        response.close()
+        response = self.request("POST", self.url_soap, headers=headers, data=payload,
+                                idempotent=idempotent, operation=f"SOAP {operation or 'call'}", **kwargs)
+        #the plain copy may still fail for its own reasons, but it was read where the compressed one was not
+        if not encoding_rejected(response):
+            self.compress_requests = False
+            if DEBUG:
+                click.echo("The API does not accept compressed requests, sending them uncompressed")
+        return response
+
+    def close(self):
+        self.session.close()
 
 class Five9Campaign:
-    def __init__(self, id, domain_id,  name, auth, type) -> None:
+    def __init__(self, id, domain_id,  name, session, type) -> None:
         self.id = id
         self.domain_id = domain_id
         self.name = name
-        self.auth = auth
+        self.session = session
         self.type = type
         self.definition = None #TODO implement functionality to get campaign definition based on type
 
     def add_parameter(self, param, value):
+        return self.add_parameters({param: value})
+
+    def add_parameters(self, parameters):
+        """
+        Adds string script parameters to every schedule entry of an inbound campaign
+
+        :param parameters: dictionary of parameter name -> value, names that already exist are left alone
+        :return: the update response, UNCHANGED if every parameter already existed or None on failure
+        """
         if not response_error_handler(self.get_inbound_campaign()):
             click.echo(f"Error: Problem Retrieving Campaign: {self.name}")
             return
         schedules = self.definition['ivrSchedule']
-        
-        if param in schedules['defaultScheduleEntry']['generalData']['scriptParameters']:
-            click.echo(f"Error: Parameter {param} already exists")
-        else:
-            #TODO update script to support multiple data types
-            schedules['defaultScheduleEntry']['generalData']['scriptParameters'].append({'name': param, 'value': {'type': 'STRING','secure':False, 'value': value}})
-            self.definition['ivrSchedule'] = schedules
-            
-
-        if 'customScheduleEntries' in schedules:
-            for schedule in schedules['customScheduleEntries']:
-                schedule['generalData']['scriptParameters'].append({'name': param, 'value': {'type': 'STRING','secure':False, 'value': value}})
-        
-        #self.definition['ivrSchedule'] = schedules
-        payload = {"ivrSchedule": schedules}
-        if response_error_handler(self.update_campaign(json.dumps(payload))):
-            click.echo(f"Success: added parameter {param} to {self.name}")
-        else:
-            click.echo(f"Error: Problem adding parameter {param} to {self.name}")
+        entries = [schedules['defaultScheduleEntry']] + schedules.get('customScheduleEntries', [])
+
+        added = []
+        for entry in entries:
+            scriptParameters = entry.setdefault('generalData', {}).setdefault('scriptParameters', [])
+            existing = {parameter['name'] for parameter in scriptParameters}
+            for param, value in parameters.items():
+                if param in existing:
+                    continue
+                #TODO update script to support multiple data types
+                scriptParameters.append({'name': param, 'value': {'type': 'STRING','secure':False, 'value': value}})
+                if param not in added:
+                    added.append(param)
+        if not added:
+            if VERBOSE:
+                click.echo(f"Parameters {', '.join(parameters)} already exist in {self.name}")
+            return UNCHANGED
+
+        with profiled("serialize"):
+            payload = json.dumps({"ivrSchedule": schedules})
+        response = self.update_campaign(payload)
+        if response_error_handler(response):
+            click.echo(f"Success: added parameter {', '.join(added)} to {self.name}")
+            return response
+        click.echo(f"Error: Problem adding parameter {', '.join(added)} to {self.name}")
     
     def get_inbound_campaign(self):
         #TODO make api call
-        url = f"{URL_REST}/{self.domain_id}/campaigns/inbound_campaigns/{self.id}"
-        response = requests.request("GET", url, auth=self.auth)
+        response = self.session.rest("GET", f"/{self.domain_id}/campaigns/inbound_campaigns/{self.id}")
         if response_error_handler(response):
-            self.definition = json.loads(response.text)
+            with profiled("parse"):
+                self.definition = json.loads(response.text)
 
         return response
 
@@ -72,27 +580,37 @@ class Five9Campaign:
     
     def update_campaign(self, payload):
         """Updates the campaign with the new json definition"""
-        url = f"{URL_REST}/{self.domain_id}/campaigns/inbound_campaigns/{self.id}"
-        response = requests.request("PUT", url, auth=self.auth, data=payload)
+        response = self.session.rest("PUT", f"/{self.domain_id}/campaigns/inbound_campaigns/{self.id}", data=payload)
         response_error_handler(response) #TODO handle errors
 
         return response
 
 class Five9Skill:
-    def __init__(self, id, domain_id, name, auth) -> None:
+    def __init__(self, id, domain_id, name, session) -> None:
         self.id = id
         self.domain_id = domain_id
         self.name = name
-        self.auth = auth
+        self.session = session
         self.prompt_id = ""
         self.prompt_name = ""
 
     def get_prompt_name(self):
         self.prompt_name = 'Whisper ' + str(self.name)
 
-    def get_prompt_id(self):
-        url = f"{URL_REST}/{DOMAIN_ID}/prompts?fields=id,name&filter=name==\'{self.prompt_name}\'"
-        response = requests.request("GET", url, auth=self.auth)
+    def get_prompt_id(self, prompts=None):
+        """
+        Sets prompt_id to the id of the prompt named prompt_name
+
+        :param prompts: optional name -> id index from Five9APIAgent.get_prompt_index, avoids one request per skill
+        :return: True if the prompt was found
+        """
+        if prompts is not None:
+            if self.prompt_name in prompts:
+                self.prompt_id = prompts[self.prompt_name]
+                return True
+            click.echo(f"Error: Problem Retrieving Prompt: {self.prompt_name}")
+            return False
+        response = self.session.rest("GET", f"/{self.domain_id}/prompts?fields=id,name&filter=name==\'{self.prompt_name}\'")
 
         if not response_error_handler(response):
             click.echo(f"Error: Problem Retrieving Prompt: {self.prompt_name}")
@@ -112,161 +630,633 @@ class Five9Skill:
         """Updates skill and assigns whisper prompt to it"""
         if self.prompt_id == "":
             return
-        url = f"{URL_REST}/{DOMAIN_ID}/skills/{self.id}"
         payload = json.dumps({"whisperPrompt": {"id": self.prompt_id}})
-        response = requests.request("PUT", url, auth=self.auth, data=payload)
+        response = self.session.rest("PUT", f"/{self.domain_id}/skills/{self.id}", data=payload)
 
         return response_error_handler(response)
     
     def set_routevm(self):
-        url = f"{URL_REST}/{DOMAIN_ID}/skills/{self.id}"
         payload = json.dumps({
         "routeVoiceMails" : "true"
         })
-        response = requests.request("PUT", url, auth=self.auth, data=payload)
+        response = self.session.rest("PUT", f"/{self.domain_id}/skills/{self.id}", data=payload)
         response_error_handler(response)
         print(f"Route VMs Code: {response.status_code}")
 
+class Five9IVRBatch:
+    """Fetches the xmlDefinitions of many scripts with one getIVRScripts call per chunk of names"""
+    def __init__(self, session, names, chunk_size=IVR_BATCH_SIZE, pattern_max=IVR_PATTERN_MAX) -> None:
+        self.session = session
+        self.chunks = []
+        self.chunk_index = {} #script name -> index of the chunk that fetches it
+        chunk, length = [], 0
+        for name in names:
+            pattern = re.escape(name)
+            if chunk and (len(chunk) >= chunk_size or length + len(pattern) + 1 > pattern_max):
+                self.chunks.append(chunk)
+                chunk, length = [], 0
+            chunk.append(pattern)
+            length += len(pattern) + 1
+            self.chunk_index[name] = len(self.chunks)
+        if chunk:
+            self.chunks.append(chunk)
+        self.locks = [threading.Lock() for chunk in self.chunks]
+        self.loaded = set()
+        self.definitions = {}
+
+    def get(self, name):
+        """returns the definition of the script, fetching its chunk the first time any script in it is requested"""
+        index = self.chunk_index.get(name)
+        if index is None:
+            return None
+        with self.locks[index]:
+            if index not in self.loaded:
+                self.loaded.add(index)
+                definitions = self.fetch(index)
+                if definitions is not None:
+                    self.definitions.update(definitions)
+                elif DEBUG or VERBOSE:
+                    click.echo(f"Error: Problem Retrieving Script Batch {index}, falling back to one request per script")
+        #each definition is handed out once so memory is released as scripts are processed
+        return self.definitions.pop(name, None)
+
+    def fetch(self, index):
+        """fetches a chunk without keeping it, returns name -> (root, digest) or None if the call failed"""
+        response = fetch_ivr_scripts(self.session, "|".join(self.chunks[index]))
+        if not response_error_handler(response):
+            return None
+        return parse_ivr_scripts(response)
+
+class IVRDigestStore:
+    """
+    Remembers, per operation, the digest of each script definition that the operation left unchanged
+
+    When the server returns the same definition again the operation is known to be a no-op and the
+    script is skipped without being processed. Digests are recorded from what the server returns rather
+    than what was uploaded, so any reformatting done by the server does not defeat the check.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as store:
+                self.digests = json.load(store)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    def get(self, operation, name):
+        with self.lock:
+            return self.digests.get(operation, {}).get(name)
+
+    def set(self, operation, name, digest):
+        with self.lock:
+            self.digests.setdefault(operation, {})[name] = digest
+
+    def save(self):
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp, "w") as store:
+                    json.dump(self.digests, store)
+                os.replace(temp, self.path)
+            except OSError as e:
+                click.echo(f"Error: Problem Saving IVR Digests: {e}")
+
+class IVRBackupStore:
+    """
+    Content addressed, compressed history of ivr definitions
+
+    Each distinct definition is stored once as objects/<digest[:2]>/<digest>.xml.gz and index.jsonl gets a
+    (script, time, digest) line for every backup taken, so the full history of every script is kept no
+    matter what characters its name contains. Backups are compressed and written by the thread saving them,
+    so a bulk run backs up as many scripts at once as it has workers.
+    """
+    def __init__(self, path=BACKUP_DIR) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.path, "objects", digest[:2], f"{digest}.xml.gz")
+
+    def save(self, name, root):
+        """records a backup of the definition for the script and returns its digest, raises OSError if the backup could not be written"""
+        data = etree.tostring(root, encoding="utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        self.write(data, {"script": name, "time": datetime.now(timezone.utc).isoformat(), "digest": digest})
+        return digest
+
+    def write(self, data, entry):
+        try:
+            path = self.object_path(entry['digest'])
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with gzip.open(temp, "wb") as backup:
+                    backup.write(data)
+                os.replace(temp, path)
+            with self.lock, open(os.path.join(self.path, "index.jsonl"), "a") as index:
+                index.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            click.echo(f"Error: Problem Backing Up Script: {entry['script']}: {e}")
+            raise
+        return entry['digest']
+
+    def read(self, digest) -> bytes:
+        """returns the stored definition with the digest given"""
+        with gzip.open(self.object_path(digest), "rb") as backup:
+            return backup.read()
+
+    def history(self, name=None) -> list:
+        """returns the index entries for the script given, or for every script, oldest first"""
+        try:
+            with open(os.path.join(self.path, "index.jsonl")) as index:
+                entries = [json.loads(line) for line in index if line.strip()]
+        except OSError:
+            return []
+        return [entry for entry in entries if name is None or entry['script'] == name]
+
+class IVRDefinitionFile:
+    """
+    A saved ivr definition that ivr restore or ivr replay sends back to the domain
+
+    :param name: script the definition belongs to
+    :param label: identifies the definition in the results, such as the file it came from
+    :param path: plain xml file holding the definition
+    :param digest: object in store holding the definition, used instead of path
+    :param store: IVRBackupStore the digest refers to
+    :param time: when the definition was saved, an aware datetime
+    """
+    def __init__(self, name, label, path=None, digest=None, store=None, time=None) -> None:
+        self.name = name
+        self.label = label
+        self.path = path
+        self.digest = digest
+        self.store = store
+        self.time = time
+
+    def load(self):
+        """reads and validates the definition, returns its root element or raises ValueError"""
+        if self.store is not None:
+            return parse_ivr_definition(self.store.read(self.digest))
+        with open(self.path, "rb") as definition:
+            return parse_ivr_definition(definition.read())
+
 class Five9IVR:
-    def __init__(self, auth, name):
-        self.auth = auth
+    def __init__(self, session, name, batch=None, digests=None, backups=None):
+        self.session = session
         self.name = name
-    def add_variable(self, name, type, input=True, output=True, BACKUP=True):
-        """Adds the variable specified to the ivr script"""
-        response = self.getScript() #TODO handle errors if script is not found
-        if not response_error_handler(response):
+        self.batch = batch #optional Five9IVRBatch the definition is loaded from
+        self.digests = digests #optional IVRDigestStore used to skip scripts already processed
+        self.backups = backups #optional IVRBackupStore shared by a bulk run
+        self.digest = None #sha256 of the definition returned by the server
+
+    def get_definition(self):
+        """returns the root element of the script's xmlDefinition or None if it could not be retrieved"""
+        definition = None
+        if self.batch is not None:
+            definition = self.batch.get(self.name)
+        if definition is None:
+            response = self.getScript()
+            if not response_error_handler(response):
+                return None
+            definition = parse_ivr_scripts(response).get(self.name)
+            if definition is None:
+                return None
+        ivrRoot, self.digest = definition
+        return ivrRoot
+
+    def backup(self, ivrRoot) -> bool:
+        """saves the definition to the backup store, returns False if it could not be written"""
+        store = self.backups if self.backups is not None else IVRBackupStore()
+        try:
+            store.save(self.name, ivrRoot)
+        except OSError:
+            return False
+        return True
+
+    def is_unchanged(self, operation):
+        """True if operation already left the definition that was just retrieved unchanged"""
+        return self.digests is not None and self.digests.get(operation, self.name) == self.digest
+
+    def mark_unchanged(self, operation):
+        if self.digests is not None:
+            self.digests.set(operation, self.name, self.digest)
+
+    def apply(self, operations, BACKUP=False):
+        """
+        Applies every operation to one copy of the definition and uploads the result once
+
+        :param operations: list of IVROperation, each one edits the IVRDocument in memory
+        :param BACKUP: saves the definition as it was retrieved before uploading any change
+        :return: the update response, UNCHANGED if no operation changed anything or None on failure
+        """
+        ivrRoot = self.get_definition()
+        if ivrRoot is None:
             click.echo(f"Error: Problem Retrieving Script: {self.name}")
             return
-        
-        #convert xml to dictionary
-        data_dict = xmltodict.parse(response.text)
-        ivrRoot = ET.fromstring(data_dict['env:Envelope']['env:Body']['ns2:getIVRScriptsResponse']['return']['xmlDefinition'], parser=ET.XMLParser(encoding="utf-8"))
-
-        if BACKUP:
-            #if the folder does not exist create it
-            if not os.path.exists("IVR Backups"):
-                os.mkdir("IVR Backups")
-            with open(f"IVR Backups/{self.name}.xml", "w") as backup:
-                backup.write(data_dict['env:Envelope']['env:Body']['ns2:getIVRScriptsResponse']['return']['xmlDefinition'])
-            backup.close()
-
-        for items in ivrRoot:
-                if items.tag == 'userVariables':
-                    xml_add_variable(items, name, type, input, output)
-                    script = ET.tostring(ivrRoot)
-                    script = script.replace(b'<', b'&lt;')
+        operations = [operation for operation in operations if not self.is_unchanged(operation.key)]
+        if not operations:
+            return UNCHANGED
+
+        original = copy.deepcopy(ivrRoot) if BACKUP else None #edits are made in place
+        document = IVRDocument(ivrRoot)
+        changed = False
+        for operation in operations:
+            if operation.apply(document, self.name):
+                changed = True
+            else:
+                self.mark_unchanged(operation.key)
+        if not changed:
+            return UNCHANGED
+
+        #the script is never changed without the backup that was asked for
+        if BACKUP and not self.backup(original):
+            click.echo(f"Error: Script {self.name} was not updated because it could not be backed up")
+            return
 
         #update ivr script
-        response = self.modifyScript(script.decode('utf-8'))
+        response = self.modifyScript(ivrRoot)
         if not response_error_handler(response):
             click.echo(f"Error: Problem Updating Script: {self.name}")
             if LOGGING:
                 #if the folder does not exist create it
-                if not os.path.exists("Failed Updates"):
-                    os.mkdir("Failed Updates")
-                with open(f"Failed Updates/{self.name}.xml", "w") as failed:
-                    failed.write(script.decode('utf-8'))
-                failed.close()
+                try:
+                    os.makedirs(FAILED_DIR, exist_ok=True)
+                    #written through a file object, lxml would treat a path holding %XX as a url and escape it again
+                    with open(os.path.join(FAILED_DIR, script_filename(self.name)), "wb") as failed:
+                        etree.ElementTree(ivrRoot).write(failed, encoding="utf-8")
+                except OSError as e:
+                    click.echo(f"Error: Problem Saving Failed Update: {self.name}: {e}")
             return
         return response
+
+    def add_variable(self, name, type, input=True, output=True, BACKUP=True):
+        """Adds the variable specified to the ivr script, returns UNCHANGED without uploading if it already exists"""
+        return self.apply([IVRAddVariable(name, type, input, output)], BACKUP)
     
     def clean(self, BACKUP=False):
-        self.handleDuplicateNames(BACKUP)
-
-    def modifyScript(self, xml):
-        """calls the modifyIVRScript api and returns the response"""
-        payload = f"<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" xmlns:ser=\"http://service.admin.ws.five9.com/\">\r\n   <soapenv:Header/>\r\n   <soapenv:Body>\r\n      <ser:modifyIVRScript>\r\n       <scriptDef>\r\n            <name>{self.name}</name>\r\n            <xmlDefinition>\r\n{xml}            \r\n            </xmlDefinition>\r\n         </scriptDef>\r\n      </ser:modifyIVRScript>\r\n   </soapenv:Body>\r\n</soapenv:Envelope>"
-        response = requests.request("POST", URL_SOAP, auth=self.auth, data=payload)
-        response.encoding = response.apparent_encoding # override encoding by real educated guess as provided by chardet
+        return self.handleDuplicateNames(BACKUP)
 
-        return response
+    def modifyScript(self, root):
+        """calls the modifyIVRScript api with the element tree as the new definition and returns the response"""
+        with profiled("serialize"):
+            body = modify_ivr_script_envelope(self.name, root)
+        return self.session.soap(body, "modifyIVRScript", compress=True)
 
     def getScript(self):
-        """calls the getIVRScripts api and returns the xml in the form of a string"""
-        payload = f"<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" xmlns:ser=\"http://service.admin.ws.five9.com/\">\r\n   <soapenv:Header/>\r\n   <soapenv:Body>\r\n      <ser:getIVRScripts>\r\n         <!--Optional:-->\r\n         <namePattern>{self.name}</namePattern>\r\n      </ser:getIVRScripts>\r\n   </soapenv:Body>\r\n</soapenv:Envelope>"
-        #headers = {"Content-Type" :"application/xml", "Accept-Encoding": "gzip,deflate,br"}
+        """calls the getIVRScripts api for this script and returns the response"""
+        return fetch_ivr_scripts(self.session, re.escape(self.name))
 
-        response = requests.request("POST", URL_SOAP, auth=self.auth, data=payload)
-        #response.encoding = response.apparent_encoding # override encoding by real educated guess as provided by chardet
-        return response
+    def handleDuplicateNames(self, BACKUP=False):
+        """Handles duplicate names by appending a number to the end of the name, returns UNCHANGED without uploading if no name changed"""
+        return self.apply([IVRClean()], BACKUP)
 
-    def xmlToAPIString(self, element):
-        """convert xml definition to string"""
-        #output = ET.tostring(element)
-        output = etree.tostring(element) #convert xml to bytes
-        output = output.replace(b'<', b'&lt;') #replace < with &lt; so that the xml is not interpreted as html
-        output = output.decode('utf-8') #convert bytes to string
+class IVRDocument:
+    """
+    An ivr script definition with its modules indexed by name and its userVariables entries indexed by key
 
-        return output
+    Every edit goes through this class so the indexes stay in step with the lxml tree they point into.
 
-    def handleDuplicateNames(self, BACKUP=False):
-        """Handles duplicate names by appending a number to the end of the name"""
+    :param root: root element of the xmlDefinition, edited in place
+    """
+    def __init__(self, root) -> None:
+        self.root = root
+        self.modules = {} #moduleName -> list of module elements with that name, in script order
+        for module in self.iter_modules():
+            self.modules.setdefault(module.findtext('moduleName'), []).append(module)
+        self.userVariables = root.find('userVariables')
+        self.variables = {} #key -> userVariables entry element
+        if self.userVariables is not None:
+            for entry in self.userVariables.iterfind('entry'):
+                self.variables[entry.findtext('key')] = entry
+
+    def iter_modules(self):
+        modules = self.root.find('modules')
+        return iter(()) if modules is None else iter(modules)
+
+    def module(self, name):
+        """returns the first module called name or None"""
+        modules = self.modules.get(name)
+        return modules[0] if modules else None
+
+    def variable(self, key):
+        """returns the userVariables entry for key or None"""
+        return self.variables.get(key)
+
+    def rename_module(self, module, newName):
+        name = module.find('moduleName')
+        modules = self.modules.get(name.text, [])
+        if module in modules:
+            modules.remove(module)
+            if not modules:
+                del self.modules[name.text]
+        name.text = newName
+        self.modules.setdefault(newName, []).append(module)
+
+    def add_variable(self, name, type, input=True, output=True):
+        """adds a userVariables entry, returns False if a variable with that key already exists"""
+        if name in self.variables:
+            return False
+        if self.userVariables is None:
+            self.userVariables = xml_add_sub_element(self.root, 'userVariables', '')
+        self.variables[name] = xml_add_variable(self.userVariables, name, type, input, output)
+        return True
+
+    def clean_module_names(self):
+        """removes "Copy of " from module names, numbering any names that become duplicates, returns the list of (module, old name, new name)"""
         frequency = {} #dictionary to keep track of how many times a name has been used
-        response = self.getScript() #TODO handle errors if script is not found
-        if not response_error_handler(response):
-            click.echo(f"Error: Problem Retrieving Script: {self.name}")
-            return
-        
-        #convert xml to dictionary
-        data_dict = xmltodict.parse(response.text)
-        scriptDefinition = data_dict['env:Envelope']['env:Body']['ns2:getIVRScriptsResponse']['return']['xmlDefinition']
-        ivrRoot = etree.fromstring(scriptDefinition.encode('utf-8'))
-
-        if BACKUP:
-            #if the folder does not exist create it
-            if not os.path.exists("IVR Backups"):
-                os.mkdir("IVR Backups")
-            with open(f"IVR Backups/{self.name}.xml", "w") as backup:
-                backup.write(data_dict['env:Envelope']['env:Body']['ns2:getIVRScriptsResponse']['return']['xmlDefinition'])
-            backup.close()
-        
-        #iterate through all the modules and remove "Copy of" from the name
-        element = ivrRoot.find('modules')
-        for module in element:
-            name = module.find('moduleName')
-            newName = name.text.replace("Copy of ", "")
+        #work out the new names first so the numbering only depends on the names as retrieved
+        renames = []
+        for module in self.iter_modules():
+            name = module.findtext('moduleName')
+            newName = name.replace("Copy of ", "")
             frequency[newName] = frequency[newName] + 1 if newName in frequency else 0
             if frequency[newName] > 0:
                 newName = newName + " " + str(frequency[newName])
-            name.text = newName
-            if VERBOSE:
-                click.echo(f"Changing {name.text} to {newName} Type: {module.tag} ")
+            if newName != name:
+                renames.append((module, name, newName))
+        for module, name, newName in renames:
+            self.rename_module(module, newName)
+        return renames
 
-        #convert xml back to string
-        output = self.xmlToAPIString(ivrRoot)
+class IVROperation:
+    """An edit applied to an IVRDocument, key identifies it in the IVRDigestStore"""
+    key = None
 
-        #update ivr script
-        response = self.modifyScript(output)
-        if not response_error_handler(response):
-            click.echo(f"Error: Problem Updating Script: {self.name}")
-            if LOGGING:
-                #if the folder does not exist create it
-                if not os.path.exists("Failed Updates"):
-                    os.mkdir("Failed Updates")
-                with open(f"Failed Updates/{self.name}.xml", "w") as failed:
-                    failed.write(output)
-                failed.close()
+    def apply(self, document, script) -> bool:
+        """edits the document and returns True if anything changed"""
+        raise NotImplementedError
+
+class IVRClean(IVROperation):
+    """Removes "Copy of " from module names"""
+    key = "clean"
+    description = "clean"
+
+    def apply(self, document, script) -> bool:
+        renames = document.clean_module_names()
+        if VERBOSE:
+            for module, name, newName in renames:
+                click.echo(f"Changing {name} to {newName} Type: {module.tag} ")
+        return bool(renames)
+
+class IVRAddVariable(IVROperation):
+    """Adds a variable to userVariables unless one with the same name exists"""
+    def __init__(self, name, type, input=True, output=True) -> None:
+        self.name = name
+        self.type = type
+        self.input = input
+        self.output = output
+        self.key = f"addvariable:{type}:{name}:{input}:{output}"
+        self.description = f"add {type}:{name}"
+
+    def apply(self, document, script) -> bool:
+        if document.add_variable(self.name, self.type, self.input, self.output):
+            return True
+        if VERBOSE:
+            click.echo(f"{script} already has variable {self.name}")
+        return False
+
+class DomainSnapshot:
+    """
+    SQLite copy of a domain's configuration written by the snapshot command
+
+    Every table keeps the REST entity as json with a sha256 digest of it, so a refresh only rewrites rows
+    whose entity changed. Campaigns also hold their full definition and scripts their gzip compressed
+    xmlDefinition, each with its digest.
+
+    :param path: database file, created with its tables and indexes if it does not exist
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS skills (id TEXT PRIMARY KEY, name TEXT, entity TEXT, digest TEXT, refreshed REAL);
+        CREATE TABLE IF NOT EXISTS prompts (id TEXT PRIMARY KEY, name TEXT, entity TEXT, digest TEXT, refreshed REAL);
+        CREATE TABLE IF NOT EXISTS call_variables (id TEXT PRIMARY KEY, name TEXT, entity TEXT, digest TEXT, refreshed REAL);
+        CREATE TABLE IF NOT EXISTS campaigns (id TEXT PRIMARY KEY, name TEXT, type TEXT, entity TEXT, digest TEXT,
+                                              definition TEXT, definition_digest TEXT, refreshed REAL);
+        CREATE TABLE IF NOT EXISTS scripts (id TEXT PRIMARY KEY, name TEXT, entity TEXT, digest TEXT,
+                                            definition BLOB, definition_digest TEXT, refreshed REAL);
+        CREATE INDEX IF NOT EXISTS skills_name ON skills (name);
+        CREATE INDEX IF NOT EXISTS prompts_name ON prompts (name);
+        CREATE INDEX IF NOT EXISTS call_variables_name ON call_variables (name);
+        CREATE INDEX IF NOT EXISTS campaigns_name ON campaigns (name);
+        CREATE INDEX IF NOT EXISTS campaigns_type ON campaigns (type);
+        CREATE INDEX IF NOT EXISTS scripts_name ON scripts (name);
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        #sweeps run on several threads, every use of the connection holds the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        #snapshots taken before campaign definitions had a digest
+        if "definition_digest" not in [column[1] for column in self.connection.execute("PRAGMA table_info(campaigns)")]:
+            self.connection.execute("ALTER TABLE campaigns ADD COLUMN definition_digest TEXT")
+        self.lock = threading.Lock()
+
+    def digests(self, table, column="digest"):
+        """returns id -> digest for every row of the table"""
+        with self.lock:
+            return dict(self.connection.execute(f"SELECT id, {column} FROM {table}"))
+
+    def write(self, table, rows):
+        """inserts rows, each a dictionary of column -> value, existing rows only have the columns given updated so their definitions are kept"""
+        if not rows:
             return
-        return response 
+        columns = list(rows[0])
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "id")
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                                        f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                                        [[row[column] for column in columns] for row in rows])
+
+    def update(self, table, id, **values):
+        with self.lock, self.connection:
+            self.connection.execute(f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                                    [*values.values(), id])
+
+    def delete(self, table, ids):
+        with self.lock, self.connection:
+            self.connection.executemany(f"DELETE FROM {table} WHERE id = ?", [(id,) for id in ids])
+
+    def set_meta(self, **values):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, str(value)) for key, value in values.items()])
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def find(self, table, name):
+        """returns the entities in the table with the name given"""
+        with self.lock:
+            rows = self.connection.execute(f"SELECT entity FROM {table} WHERE name = ?", (name,)).fetchall()
+        return [json.loads(entity) for entity, in rows]
+
+    def script_digests(self):
+        """returns script name -> digest of the stored xmlDefinition for every script, None for scripts whose definition has not been stored"""
+        with self.lock:
+            return dict(self.connection.execute("SELECT name, definition_digest FROM scripts"))
+
+    def script_definition(self, name):
+        """returns the root element of the stored xmlDefinition of a script or None"""
+        with self.lock:
+            row = self.connection.execute("SELECT definition FROM scripts WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return etree.fromstring(gzip.decompress(row[0]), etree.XMLParser(huge_tree=True))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class IVRIndex:
+    """
+    Inverted index of every ivr script, persisted in SQLite so queries never touch the API
+
+    Maps module types, module names, referenced variables, skills and prompts to the (script, module)
+    that uses them, and userVariables keys to the script that declares them. Each script's digest is
+    stored with it so a refresh only re-indexes scripts whose definition changed.
+
+    :param path: database file, created with its tables and indexes if it does not exist
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scripts (name TEXT PRIMARY KEY, digest TEXT, indexed REAL);
+        CREATE TABLE IF NOT EXISTS terms (kind TEXT, term TEXT, script TEXT, module TEXT, module_type TEXT);
+        CREATE INDEX IF NOT EXISTS terms_term ON terms (kind, term);
+        CREATE INDEX IF NOT EXISTS terms_script ON terms (script);
+    """
+    KINDS = ("type", "module", "variable", "skill", "prompt", "uservariable")
+
+    def __init__(self, path) -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def terms(root):
+        """yields (kind, term, module name, module type) for everything in the definition that can be queried"""
+        for modules in (root.find('modules'), root.find('modulesOnHangup')):
+            for module in ([] if modules is None else modules):
+                name = module.findtext('moduleName')
+                yield ("type", module.tag, name, module.tag)
+                yield ("module", name, name, module.tag)
+                for element in module.iter():
+                    tag = element.tag.lower() if isinstance(element.tag, str) else ""
+                    if "variable" in tag and len(element) == 0 and element.text and element.text.strip():
+                        yield ("variable", element.text.strip(), name, module.tag)
+                    elif tag.endswith("skill") or tag.endswith("prompt"):
+                        reference = element.findtext('name')
+                        if reference:
+                            yield ("skill" if tag.endswith("skill") else "prompt", reference, name, module.tag)
+        userVariables = root.find('userVariables')
+        for key in ([] if userVariables is None else userVariables.iterfind('entry/key')):
+            yield ("uservariable", key.text, None, None)
+
+    def digests(self):
+        """returns script name -> digest of the definition it was indexed from"""
+        with self.lock:
+            return dict(self.connection.execute("SELECT name, digest FROM scripts"))
+
+    def add(self, name, root, digest):
+        """replaces everything indexed for the script with the terms of root"""
+        rows = {(kind, term, name, module, module_type) for kind, term, module, module_type in self.terms(root)}
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM terms WHERE script = ?", (name,))
+            self.connection.executemany("INSERT INTO terms (kind, term, script, module, module_type) VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO scripts (name, digest, indexed) VALUES (?, ?, ?)", (name, digest, time.time()))
+
+    def remove(self, names):
+        with self.lock, self.connection:
+            for name in names:
+                self.connection.execute("DELETE FROM terms WHERE script = ?", (name,))
+                self.connection.execute("DELETE FROM scripts WHERE name = ?", (name,))
+
+    def query(self, kind, pattern):
+        """returns (script, module, module type) for every term of the kind matching the glob pattern"""
+        with self.lock:
+            return self.connection.execute("SELECT DISTINCT script, module, module_type FROM terms WHERE kind = ? AND term GLOB ? "
+                                           "ORDER BY script, module", (kind, pattern)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class BulkJournal:
+    """
+    Append only record of every entity a bulk command has finished, so an interrupted run can be resumed
+
+    Each line is json with the entity key, whether it succeeded and any error. Lines are flushed as they
+    are written, so everything finished before a crash or Ctrl-C is kept. A torn last line is ignored.
+
+    :param path: journal file
+    :param job: description of the command, written at the top of a new journal
+    :param resume: keeps the existing journal, otherwise a new one is started
+    """
+    def __init__(self, path, job, resume=False) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.finished = set() #keys whose latest entry succeeded
+        if resume:
+            try:
+                with open(path) as journal:
+                    for line in journal:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        if "key" not in entry:
+                            continue
+                        if entry['success']:
+                            self.finished.add(entry['key'])
+                        else:
+                            self.finished.discard(entry['key'])
+            except OSError:
+                pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "a" if resume else "w")
+        if not resume or self.file.tell() == 0:
+            self.write({"job": job, "started": time.time()})
+
+    def write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def record(self, key, success, error=None):
+        self.write({"key": key, "success": success, "error": error, "time": time.time()})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
 
 class Five9APIAgent:
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, pool_size=POOL_SIZE):
         if username == None and password == None:
-            load_dotenv()
+            dotenv.load_dotenv()
             username = os.environ.get("VCC-Username")
             password = os.environ.get("VCC-Password")
             if username == None and password == None:
-                self.auth = get_auth()
+                auth = get_auth()
             else:
-                self.auth = HTTPBasicAuth(username, password)
+                auth = requests_auth.HTTPBasicAuth(username, password)
         else:
-            self.auth = HTTPBasicAuth(username, password)
-        self.get_domain_id() #TODO add a loop to ensure that this can be collected 
+            auth = requests_auth.HTTPBasicAuth(username, password)
+        self.session = Five9Session(auth, pool_size=pool_size) #shared by every entity this agent creates
+        self.call_variables = None #fullName -> id, loaded on first use by get_call_variable_index
+        self.call_variables_lock = threading.Lock()
+        if not self.load_cached_domain():
+            self.get_domain_id()
+            self.save_cached_domain() 
 
     def get_partition_admin_username(self):
-        payload={}
-        url = f"{URL_REST}/{self.domain_id}/users?limit=100&filter=partitionAdminRole=isnull=false"
-        response = requests.request("GET", url, auth=self.auth, data=payload)
+        response = self.session.rest("GET", f"/{self.domain_id}/users?limit=100&filter=partitionAdminRole=isnull=false")
         if response.status_code == 401:
             print("Error: Invalid credentials")
             return None
@@ -277,18 +1267,69 @@ class Five9APIAgent:
             partitionAdmin = json.loads(response.text)
         return partitionAdmin['entities'][0]['userName']
     
+    def domain_cache_key(self):
+        """
+        key for this agent's user in the domain cache
+
+        Nothing derived from the password is stored, a wrong password still fails on the first call made with it.
+        """
+        return f"{self.session.auth.username}@{self.session.url_soap}"
+
+    def load_cached_domain(self, ttl=DOMAIN_CACHE_TTL):
+        """sets domain_id and domain_name from the local cache, returns False if there is no fresh entry"""
+        if REFRESH_DOMAIN:
+            return False
+        try:
+            with open(os.path.join(CACHE_DIR, "domains.json")) as cache:
+                entry = json.load(cache).get(self.domain_cache_key())
+        except (OSError, ValueError):
+            return False
+        if entry is None or time.time() - entry['time'] > ttl:
+            return False
+        self.domain_id = entry['domain_id']
+        self.domain_name = entry['domain_name']
+        return True
+
+    def save_cached_domain(self):
+        """records domain_id and domain_name in the local cache"""
+        path = os.path.join(CACHE_DIR, "domains.json")
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            try:
+                with open(path) as cache:
+                    domains = json.load(cache)
+            except (OSError, ValueError):
+                domains = {}
+            #entries from older versions were keyed by a hash of the password, they are dropped so it can not be brute forced
+            domains = {key: entry for key, entry in domains.items() if "@" in key}
+            domains[self.domain_cache_key()] = {"domain_id": self.domain_id, "domain_name": self.domain_name, "time": time.time()}
+            #write to a temporary file first so concurrent invocations never read a half written cache
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "w") as cache:
+                json.dump(domains, cache)
+            os.chmod(temp, 0o600)
+            os.replace(temp, path)
+        except OSError as e:
+            if DEBUG or VERBOSE:
+                click.echo(f"Error: Problem Saving Domain Cache: {e}")
+
     def get_domain_id(self):
         #TODO Allow user to manually input domain id
         payload = "<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" xmlns:ser=\"http://service.admin.ws.five9.com/\">\r\n   <soapenv:Header/>\r\n   <soapenv:Body>\r\n      <ser:getVCCConfiguration/>\r\n   </soapenv:Body>\r\n</soapenv:Envelope>"
-        while True:    
-            response = requests.request("POST", URL_SOAP, auth=self.auth, data=payload)
-            if response_error_handler(response):
-                break
+        #the old api fails intermittently, the session retries it with backoff
+        try:
+            response = self.session.soap(payload, "getVCCConfiguration")
+        except (requests.exceptions.RequestException, CircuitOpenError) as e:
+            click.echo(f"Error: Problem Getting Domain ID: {e}")
+            exit(1)
+        if not response_error_handler(response):
+            if response.status_code == 401:
+                click.echo(f"Error: Invalid credentials")
             else:
-                if DEBUG or VERBOSE:
-                    click.echo(f"Error: One of the old APIs Failed. Trying again...")
-                pass
-        domain = xmltodict.parse(response.text)
+                click.echo(f"Error: Problem Getting Domain ID: {response.status_code} {response.reason}")
+            exit(1)
+        with profiled("parse"):
+            domain = xmltodict.parse(response.text)
         try:
             self.domain_id = domain['env:Envelope']['env:Body']['ns2:getVCCConfigurationResponse']['return']['domainId']
             self.domain_name = domain['env:Envelope']['env:Body']['ns2:getVCCConfigurationResponse']['return']['domainName']
@@ -297,113 +1338,217 @@ class Five9APIAgent:
             exit(1)
         return self.domain_id
     
+    def paginate(self, path, limit=RESULTSMAX, prefetch=PREFETCH_PAGES, offset=0, **params):
+        """
+        Yields every entity of a REST list endpoint as its pages arrive
+
+        Once a full page shows more results exist, the next page is requested while callers work through
+        the current one. Every further full page requests one more page ahead, up to prefetch, so a short
+        list costs at most one extra request and a long one keeps several pages in flight.
+
+        :param path: endpoint path relative to URL_REST
+        :param limit: page size
+        :param prefetch: maximum number of pages requested ahead of the one being yielded
+        :param offset: offset of the first page
+        :param params: extra query parameters such as fields, sort, order and filter
+        :raises ListingError: if a page could not be retrieved, after the entities of the pages before it were yielded
+        """
+        def get_page(page_offset):
+            response = self.session.rest("GET", path, params={**params, "limit": limit, "offset": page_offset})
+            if not response_error_handler(response):
+                raise ListingError(f"Problem Retrieving {path} at offset {page_offset}: {response.status_code} {response.reason}")
+            with profiled("parse"):
+                return json.loads(response.text)
+
+        def is_full(page):
+            return int(page.get('resultsCount', len(page['entities']))) >= limit
+
+        page = get_page(offset)
+        if not is_full(page):
+            yield from page['entities']
+            return
+
+        pool = concurrent_futures.ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque()
+        try:
+            next_offset = offset + limit
+            ahead = 0 #number of pages kept in flight, grows while pages keep coming back full
+            def request_ahead():
+                nonlocal next_offset, ahead
+                ahead = min(prefetch, ahead + 1)
+                while len(pending) < ahead:
+                    pending.append(pool.submit(get_page, next_offset))
+                    next_offset += limit
+            request_ahead()
+            yield from page['entities']
+            while is_full(page):
+                page = pending.popleft().result()
+                if is_full(page):
+                    request_ahead()
+                yield from page['entities']
+        finally:
+            #pages past the end of the results are not needed once a short page is found
+            pool.shutdown(wait=False, cancel_futures=True)
+
     def get_campaigns(self, limit=RESULTSMAX, fields=None, sort=None, offset=0, order=None, filter=None):
-        url = f"{URL_REST}/{self.domain_id}/campaigns"
-        response = requests.request("GET", url, auth=self.auth, params={"limit": limit, "fields": fields, "sort": sort, "offset": offset, "order": order, "filter": filter})
-        response_error_handler(response)
-        campaigns = json.loads(response.text)
-        return campaigns
+        """yields every campaign as the pages arrive"""
+        return self.paginate(f"/{self.domain_id}/campaigns", limit, offset=offset, fields=fields, sort=sort, order=order, filter=filter)
     
     def get_skills(self, limit=RESULTSMAX, fields=None, sort=None, offset=0, order=None, filter=None):
-        url = f"{URL_REST}/{self.domain_id}/skills"
-        results = RESULTSMAX
-        skills = []
-        
-        #hit api and get all the skills
-        while results == RESULTSMAX:
-            response = requests.request("GET", url, auth=self.auth, params={"limit": limit, "fields": fields, "sort": sort, "offset": offset, "order": order, "filter": filter})
-            response_error_handler(response)
-            full_response = json.loads(response.text)
-            skills = skills + full_response['entities']
-            results = int(full_response['resultsCount'])
-            offset += RESULTSMAX
-        
-        #create Five9Skill objects
-        output = []
-        for skill in skills:
-            output.append(Five9Skill(skill['id'], self.domain_id, skill['name'], self.auth))
-        return output
+        """returns a Five9Skill for every skill"""
+        skills = self.paginate(f"/{self.domain_id}/skills", limit, offset=offset, fields=fields, sort=sort, order=order, filter=filter)
+        return [Five9Skill(skill['id'], self.domain_id, skill['name'], self.session) for skill in skills]
 
     def get_ivrs(self, limit=RESULTSMAX, fields=None, sort=None, offset=0, order=None, filter=None):
-        url = f"{URL_REST}/{self.domain_id}/scripts"
-        results = RESULTSMAX
-        ivrs = []
-        while results == RESULTSMAX:
-            response = requests.request("GET", url, auth=self.auth, params={"limit": limit, "fields": fields, "sort": sort, "offset": offset, "order": order, "filter": filter})
-            response_error_handler(response)
-            full_response = json.loads(response.text)
-            ivrs = ivrs + full_response['entities']
-            results = int(full_response['resultsCount'])
-            offset += RESULTSMAX
-        return ivrs
+        """returns the REST entity of every ivr script"""
+        return list(self.paginate(f"/{self.domain_id}/scripts", limit, offset=offset, fields=fields, sort=sort, order=order, filter=filter))
+
+    def get_prompt_index(self):
+        """returns a dictionary of prompt name -> id for every prompt in the domain"""
+        return {prompt['name']: prompt['id'] for prompt in self.paginate(f"/{self.domain_id}/prompts", fields="id,name")}
+
+    def get_ivr_scripts(self, chunk_size=IVR_BATCH_SIZE, digests=None, backups=None, exclude=()):
+        """returns a Five9IVR for every script not owned by another user, their definitions are fetched in batches except for the excluded names"""
+        names = [ivr['name'] for ivr in self.get_ivrs() if "owner" not in ivr.keys()]
+        batch = Five9IVRBatch(self.session, [name for name in names if name not in exclude], chunk_size)
+        return [Five9IVR(self.session, name, batch, digests, backups) for name in names]
+
+    def get_ivr_digests(self):
+        """returns the IVRDigestStore for this domain"""
+        return IVRDigestStore(os.path.join(CACHE_DIR, f"ivr-digests-{self.domain_id}.json"))
     
+    def get_journal(self, job, resume=False):
+        """returns the BulkJournal of a bulk command in this domain, job describes the command and what it changes"""
+        name = hashlib.sha256(job.encode("utf-8")).hexdigest()[:16]
+        return BulkJournal(os.path.join(CACHE_DIR, "journals", f"{self.domain_id}-{name}.jsonl"), job, resume)
+
+    def get_ivr_index(self):
+        """returns the IVRIndex for this domain"""
+        return IVRIndex(os.path.join(CACHE_DIR, f"ivr-index-{self.domain_id}.sqlite"))
+
+    def get_call_variable_index(self):
+        """returns a dictionary of call variable fullName -> id, paging through /call-variables the first time it is needed"""
+        with self.call_variables_lock:
+            if self.call_variables is None:
+                variables = self.paginate(f"/{self.domain_id}/call-variables", fields="id,fullName")
+                self.call_variables = {variable['fullName']: variable['id'] for variable in variables}
+            return self.call_variables
+
+    def invalidate_call_variables(self):
+        """forgets the call variable index so the next lookup reloads it, call after creating variables"""
+        with self.call_variables_lock:
+            self.call_variables = None
+
     def get_cav_id(self, name):
-        url = f"{URL_REST}/{self.domain_id}/call-variables?filter=fullName==\"{name}\""
-        response = requests.request("GET", url, auth=self.auth)
-        if not response_error_handler(response):
-            return None
-        return json.loads(response.text)["entities"][0]["id"]
+        """returns the id of the call variable with the full name given (Group.Name) or None if it does not exist"""
+        return self.get_call_variable_index().get(name)
     
     def create_list(self, name):
-        url = f"{URL_REST}/{self.domain_id}/call-lists"
-
         payload = json.dumps({"name": name, "kind": "CALL_LIST"})
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-
-        response = requests.request("POST", url, auth=self.auth, headers=headers, data=payload)
+        response = self.session.rest("POST", f"/{self.domain_id}/call-lists", data=payload)
         response_error_handler(response)
         return response
     
     def create_contact_field(self, name,displayMode,dataType):
-        url = f"{URL_REST}/{self.domain_id}/contact-fields"
-
         payload = json.dumps({"name": name,"type": "CUSTOM","displayMode": displayMode,
                                 "dataType": dataType,"kind": "CONTACT_FIELD"})
-        headers = {'Content-Type': 'application/json','Accept': 'application/json'}
-
-        response = requests.request("POST", url, auth=self.auth, headers=headers, data=payload)
-        response_error_handler(response)
+        response = self.session.rest("POST", f"/{self.domain_id}/contact-fields", data=payload)
+        if response_error_handler(response):
+            #contact fields are exposed as Customer.<name> call variables
+            self.invalidate_call_variables()
         return response
     
 #command line functionality
-@click.group()
+class FanOutGroup(click.Group):
+    """Keeps the full command line so --domains can run the same command once per domain"""
+    def parse_args(self, ctx, args):
+        ctx.meta['args'] = list(args)
+        return super().parse_args(ctx, args)
+
+    def invoke(self, ctx):
+        #a list that could not be retrieved completely fails the command rather than letting it work on part of the domain
+        try:
+            return super().invoke(ctx)
+        except ListingError as e:
+            raise click.ClickException(str(e))
+
+@click.group(cls=FanOutGroup)
 @click.option('--verbose', default=False, is_flag=True, help="Will print verbose messages.")
 @click.option('--debug', default=False, is_flag=True, help="Will print debug messages.")
-def cli(verbose, debug):
+@click.option('--refresh-domain', default=False, is_flag=True, help="Ignores the cached domain id and asks the API for it again.")
+@click.option('--profile', default=False, is_flag=True, help="Prints a summary of every API call and where the time went at exit.")
+@click.option('--profile-trace', default=None, type=click.Path(dir_okay=False, writable=True), help="Also writes every API call to this file as JSON lines. Implies --profile.")
+@click.option('--domains', default=None, type=click.Path(exists=True, dir_okay=False), help="CSV file with name, username and password columns. Runs the command once for every domain in it.")
+@click.option('--processes', default=DOMAIN_PROCESSES, type=click.IntRange(min=1), help="Number of domains worked on at once with --domains")
+@click.pass_context
+def cli(ctx, verbose, debug, refresh_domain, profile, profile_trace, domains, processes):
     """This tool is used to automate vcc configuration tasks"""
+    if domains:
+        if ctx.invoked_subcommand in (None, "whisper"):
+            click.echo("Error: --domains needs a command that runs without prompting, whisper waits for a manual upload")
+            ctx.exit(1)
+        #every domain runs the same command line without the fan out options, each in its own process
+        args = strip_options(ctx.meta['args'], ("--domains", "--processes"))
+        ctx.exit(run_domains(read_domains(domains), args, processes, verbose))
     global VERBOSE
     global DEBUG
-    global DOMAIN_ID
+    global REFRESH_DOMAIN
+    global PROFILER
     VERBOSE = verbose
     DEBUG = debug
-    DOMAIN_ID = "me"
+    REFRESH_DOMAIN = refresh_domain
+    if profile or profile_trace:
+        PROFILER = Five9Profiler(profile_trace)
+        def report():
+            PROFILER.close()
+            PROFILER.report()
+        ctx.call_on_close(report)
 
 @cli.command()
 @click.option('--username', type=click.STRING)
 @click.option('--password', type=click.STRING)
 @click.option('--name', "-n", type=click.STRING , help="The name of the target campaign", default=None)
-@click.option('--parameter', '-p', type=click.STRING, help="The parameters to be passed to the campaign Format: \"name:value\"", default=None)
-def campaign(username, password, name, parameter): #TODO implement functionality to interact with campaigns
+@click.option('--parameter', '-p', type=click.STRING, multiple=True, help="The parameters to be passed to the campaign Format: \"name:value\", may be repeated")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of campaigns updated at once")
+@click.option('--resume', default=False, is_flag=True, help="Skips the campaigns an interrupted run with the same parameters already finished")
+def campaign(username, password, name, parameter, workers, resume): #TODO implement functionality to interact with campaigns
     """Provides configuration operations for campaigns"""
     if username == None or password == None:
-        agent=Five9APIAgent()
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
     else:
-        agent = Five9APIAgent(username, password)
-    DOMAIN_ID = agent.domain_id
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
     if name == None:
         objects = agent.get_campaigns()
     else:
         objects = agent.get_campaigns(filter=f"name==\'{name}\'")
 
-    for object in objects["entities"]:
-        click.echo(object['name'])
-        campaign = Five9Campaign(object['id'], agent.domain_id, object['name'], agent.auth, type=object['type'])
-        if parameter != None:
-            if campaign.type != "INBOUND":
-                click.echo(f"Error: Can't add parameter {campaign.name} is not an inbound campaign")
+    if not parameter:
+        for object in objects:
+            click.echo(object['name'])
+        return
+
+    parameters = {}
+    for entry in parameter:
+        if ":" not in entry:
+            raise click.BadParameter(f"{entry} is not in the format name:value", param_hint="--parameter")
+        param, value = entry.split(":", 1)
+        parameters[param] = value
+
+    def inbound_campaigns():
+        for object in objects:
+            if object['type'] != "INBOUND":
+                if name != None or VERBOSE:
+                    click.echo(f"Error: Can't add parameter {object['name']} is not an inbound campaign")
                 continue
-            param, value = parameter.split(":")
-            campaign.add_parameter(param, value)
+            yield Five9Campaign(object['id'], agent.domain_id, object['name'], agent.session, type=object['type'])
+
+    journal = agent.get_journal("campaign " + " ".join(f"-p {param}:{value}" for param, value in sorted(parameters.items())), resume)
+    #campaigns are handed to the workers as their pages arrive
+    try:
+        results = run_bulk(inbound_campaigns(), lambda campaign: campaign.add_parameters(parameters), workers, journal=journal)
+    finally:
+        journal.close()
+    print_bulk_summary(results, f"Added {', '.join(parameters)} to")
 
 
 @cli.command() 
@@ -411,83 +1556,194 @@ def skill(): #TODO implement functionality to interact with skills
     """Provides configuration operations for skills"""
     pass
 
-@cli.command()
+@cli.group(invoke_without_command=True)
 @click.option('--username', type=click.STRING)
 @click.option('--password', type=click.STRING)
 @click.option('--name', "-n", type=click.STRING , help="The name of the target script", default=None)
 @click.option('--clean', "-c", default=False, is_flag=True, help="Removes \"Copy of \" from IVR module names")
 @click.option('--backup', "-b", default=False, is_flag=True, help="Creates a backup of the IVR before any operations are performed")
-@click.option('--addvariable', "-av", default=None, type=click.STRING, help="Adds a variable to the IVR script. Format: \"type:name\"")
-def ivr(username, password, name, clean, backup, addvariable):
+@click.option('--addvariable', "-av", multiple=True, type=click.STRING, callback=lambda ctx, param, values: [parse_variable(value) for value in values], help="Adds a variable to the IVR script. Format: \"type:name\", may be repeated and combined with --clean")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of scripts processed at once when no name is given")
+@click.option('--force', "-f", default=False, is_flag=True, help="Processes every script, even those unchanged since a previous run found nothing to do")
+@click.option('--resume', default=False, is_flag=True, help="Skips the scripts an interrupted run with the same edits already finished")
+@click.pass_context
+def ivr(ctx, username, password, name, clean, backup, addvariable, workers, force, resume):
     """Provides configuration operations for ivrs"""
+    if ctx.invoked_subcommand is not None:
+        return
+    #every requested edit is applied to a single copy of each script, which is uploaded once
+    operations = [IVRClean()] if clean else []
+    for type, variable in dict.fromkeys(addvariable):
+        operations.append(IVRAddVariable(variable, type))
+    if not operations:
+        return
+    #adding variables has always backed the script up first
+    backup = backup or bool(addvariable)
+    description = ", ".join(operation.description for operation in operations)
+
     #agent = auth(username, password)
     if username == None or password == None:
-        agent=Five9APIAgent()
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
     else:
-        agent = Five9APIAgent(username, password)
-    DOMAIN_ID = agent.domain_id
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
     script = name
-    if clean:
-        if script == None:
-            ivrs = agent.get_ivrs()
-            for ivr in ivrs:
-                if "owner" not in ivr.keys():
-                    click.echo(f"Cleaning {ivr['name']}")
-                    ivr = Five9IVR(agent.auth, ivr['name'])
-                    ivr.clean(backup)
-        else:
-            click.echo(f"Cleaning {script}")
-            ivr = Five9IVR(agent.auth, script)
-            ivr.clean(backup)
-    elif addvariable != None:
-        type, name  = addvariable.split(":")
-        if script == None:
-            ivrs = agent.get_ivrs()
-            for ivr in ivrs:
-                if "owner" not in ivr.keys():
-                    click.echo(f"Adding {name} to {ivr['name']}")
-                    ivr = Five9IVR(agent.auth, ivr['name'])
-                    ivr.add_variable(name, type)
+    if script == None:
+        digests = None if force else agent.get_ivr_digests()
+        backups = IVRBackupStore()
+        journal = agent.get_journal("ivr " + description, resume)
+        #scripts finished by an interrupted run are left out of the batches so their xml is not downloaded again
+        ivrs = agent.get_ivr_scripts(digests=digests, backups=backups, exclude=journal.finished)
+        def update_ivr(ivr):
+            click.echo(f"Updating {ivr.name}: {description}")
+            return ivr.apply(operations, backup)
+        try:
+            results = run_bulk(ivrs, update_ivr, workers, journal=journal)
+        finally:
+            journal.close()
+            if digests is not None:
+                digests.save()
+        print_bulk_summary(results, "Updated")
+    else:
+        click.echo(f"Updating {script}: {description}")
+        ivr = Five9IVR(agent.session, script)
+        ivr.apply(operations, backup)
+
+@ivr.command()
+@click.option('--username', type=click.STRING)
+@click.option('--password', type=click.STRING)
+@click.option('--type', "-t", "types", multiple=True, help="Module type, such as skillTransfer or play")
+@click.option('--module', "-m", "modules", multiple=True, help="Module name")
+@click.option('--variable', "-v", "variables", multiple=True, help="Variable referenced by a module, such as Call.ANI")
+@click.option('--skill', "-s", "skills", multiple=True, help="Skill referenced by a module")
+@click.option('--prompt', "-p", "prompts", multiple=True, help="Prompt referenced by a module")
+@click.option('--uservariable', "-u", "uservariables", multiple=True, help="Key declared in userVariables")
+@click.option('--refresh', "-r", default=False, is_flag=True, help="Re-indexes scripts changed since the index was last refreshed before querying")
+@click.option('--snapshot', default=None, type=click.Path(exists=True, dir_okay=False), help="Refreshes the index from a snapshot file instead of the API")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of script batches fetched at once while refreshing")
+def query(username, password, types, modules, variables, skills, prompts, uservariables, refresh, snapshot, workers):
+    """
+    Finds the scripts and modules that use a module type, name, variable, skill or prompt
+
+    Values may use * and ? wildcards. Modules must match every module option given and scripts every
+    --uservariable. The index is built the first time it is queried and after that only updated when
+    --refresh or --snapshot is given.
+    """
+    criteria = [(kind, pattern) for kind, patterns in (("type", types), ("module", modules), ("variable", variables),
+                ("skill", skills), ("prompt", prompts), ("uservariable", uservariables)) for pattern in patterns]
+    if username == None or password == None:
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
+    else:
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
+    index = agent.get_ivr_index()
+    if refresh or snapshot or not index.digests():
+        store = DomainSnapshot(snapshot) if snapshot else None
+        if store is not None:
+            #another domain's scripts would be mixed into this domain's index
+            domain_id, domain_name = store.get_meta("domain_id"), store.get_meta("domain_name")
+            if domain_id != str(agent.domain_id):
+                store.close()
+                index.close()
+                raise click.BadParameter(f"{snapshot} is a snapshot of {domain_name or 'an unknown domain'} ({domain_id}), not {agent.domain_name} ({agent.domain_id})",
+                                         param_hint="--snapshot")
+        counts = refresh_ivr_index(agent, index, workers, store)
+        if store is not None:
+            store.close()
+        click.echo(f"Indexed {counts['indexed']} changed scripts, removed {counts['removed']}, {counts['total']} scripts in the index", err=True)
+
+    #module criteria must all match the same module, userVariables keys only narrow down the scripts
+    modules = None #set of (script, module, module type)
+    scripts = None
+    for kind, pattern in criteria:
+        found = set(index.query(kind, pattern))
+        if kind == "uservariable":
+            found = {script for script, module, module_type in found}
+            scripts = found if scripts is None else scripts & found
         else:
-            ivr = Five9IVR(agent.auth, script)
-            click.echo(f"Adding {addvariable} to {script}")
-            ivr.add_variable(name, type)
+            modules = found if modules is None else modules & found
+    index.close()
+    if not criteria:
+        return
+    if modules is not None:
+        modules = sorted(match for match in modules if scripts is None or match[0] in scripts)
+        for script, module, module_type in modules:
+            click.echo(f"{script}\t{module} ({module_type})")
+        scripts = {script for script, module, module_type in modules}
+    else:
+        for script in sorted(scripts):
+            click.echo(script)
+    click.echo(f"{len(scripts)} scripts matched", err=True)
+
+@ivr.command()
+@click.option('--username', type=click.STRING)
+@click.option('--password', type=click.STRING)
+@click.option('--name', "-n", "names", multiple=True, help="Only restores this script, may be repeated")
+@click.option('--before', default=None, type=click.STRING, help="Restores the newest backup taken before this time, such as 2024-05-01T13:00. Default: the newest backup")
+@click.option('--dir', "path", default=BACKUP_DIR, type=click.Path(exists=True, file_okay=False), help="Backup folder written by ivr -b")
+@click.option('--dry-run', default=False, is_flag=True, help="Only checks the backups, nothing is uploaded")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of scripts uploaded at once")
+def restore(username, password, names, before, path, dry_run, workers):
+    """
+    Uploads the newest backup of every script in the backup folder
+
+    Reads the compressed backups listed in index.jsonl as well as the <script>.xml files older versions
+    of this tool wrote. Undoes a domain wide ivr -b run in one go.
+    """
+    if before is not None:
+        try:
+            before = datetime.fromisoformat(before).astimezone(timezone.utc)
+        except ValueError:
+            raise click.BadParameter(f"{before} is not an ISO 8601 time", param_hint="--before")
+    backups = find_ivr_backups(IVRBackupStore(path), names, before)
+    if not backups:
+        click.echo(f"Error: No backups found in {path}")
+        return
+    if username == None or password == None:
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
+    else:
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
+    results = push_ivr_definitions(agent, backups, workers, dry_run)
+    print_bulk_summary(results, "Checked" if dry_run else "Restored")
+
+@ivr.command()
+@click.option('--username', type=click.STRING)
+@click.option('--password', type=click.STRING)
+@click.option('--name', "-n", "names", multiple=True, help="Only replays this script, may be repeated")
+@click.option('--dir', "path", default=FAILED_DIR, type=click.Path(exists=True, file_okay=False), help="Folder of definitions that failed to upload")
+@click.option('--dry-run', default=False, is_flag=True, help="Only checks the files, nothing is uploaded")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of scripts uploaded at once")
+def replay(username, password, names, path, dry_run, workers):
+    """
+    Uploads every definition that failed to upload again
+
+    Files that upload successfully are deleted so running it again only retries what is left.
+    """
+    if username == None or password == None:
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
+    else:
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
+    #the folder is read as the workers take files from it
+    results = push_ivr_definitions(agent, find_failed_updates(path, names), workers, dry_run, remove=not dry_run)
+    if not results:
+        click.echo(f"No failed updates found in {path}")
+        return
+    print_bulk_summary(results, "Checked" if dry_run else "Replayed")
 
 @cli.command()
 @click.option('--audio', default=False, is_flag=True, help="Completes all the steps in this guide: https://fivn.sharepoint.com/sites/gts2/SitePages/Tracking-Agent-Audio-Issues.aspx")
 @click.option('--username', type=click.STRING)
 @click.option('--password', type=click.STRING)
-def troubleshoot(username, password, audio):
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of provisioning steps run at once")
+def troubleshoot(username, password, audio, workers):
     """Assists in domain troubleshooting"""
     if username == None or password == None:
-        agent=Five9APIAgent()
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
     else:
-        agent = Five9APIAgent(username, password)
-    DOMAIN_ID = agent.domain_id
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
     if audio:
         click.echo("Configuring Domain")
-        click.echo("Creating Quality Issues List")
-        agent.create_list("Quality Issues")
-        click.echo("Creating Contact Fields")
-        agent.create_contact_field("Agent Name","HIDDEN","STRING")
-        agent.create_contact_field("ANI","HIDDEN","STRING")
-        agent.create_contact_field("DNIS","HIDDEN","STRING")
-        agent.create_contact_field("Call_ID","HIDDEN","STRING")
-        agent.create_contact_field("Session_ID","HIDDEN","STRING")
-        agent.create_contact_field("Campaign","HIDDEN","STRING")
-        agent.create_contact_field("Quality Issue","HIDDEN","STRING")
-        agent.create_contact_field("Create_Date","HIDDEN","DATE_TIME")
-        id_agent_name = agent.get_cav_id("Customer.Agent Name")
-        id_ani = agent.get_cav_id("Call.ANI")
-        id_dnis = agent.get_cav_id("Call.DNIS")
-        id_call_id = agent.get_cav_id("Call.call_id")
-        id_session_id = agent.get_cav_id("Call.session_id")
-        id_campaign = agent.get_cav_id("Call.campaign_name")
-        id_number1 = agent.get_cav_id("Customer.number1")
-        click.echo("Creating Audio Issue Connectors")
-        create_audio_issue_connector("Dead Air", agent, id_agent_name, id_ani, id_dnis, id_call_id, id_session_id, id_campaign, id_number1)
-        create_audio_issue_connector("One Way Audio", agent, id_agent_name, id_ani, id_dnis, id_call_id, id_session_id, id_campaign, id_number1)
-        create_audio_issue_connector("Dropped Call", agent, id_agent_name, id_ani, id_dnis, id_call_id, id_session_id, id_campaign, id_number1)
+        plan = audio_issue_plan(agent, workers)
+        plan.run()
+        plan.print_report()
     else:
         click.echo("Please use a flag to specify which troubleshooting task you would like to perform")
 
@@ -495,15 +1751,17 @@ def troubleshoot(username, password, audio):
 @click.option('--username', type=click.STRING)
 @click.option('--password', type=click.STRING)
 @click.option('--out', "-o", type=click.STRING , help="", default=None) #TODO update click type and allow user to specify output file
-def whisper(username, password, out):
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of skills updated at once")
+@click.option('--resume', default=False, is_flag=True, help="Skips the skills an interrupted run already assigned a prompt to")
+def whisper(username, password, out, workers, resume):
     """Creates Whispers prompts and assigns them to skills"""
     outfile = "whisper.csv"
     if username == None or password == None:
-        agent=Five9APIAgent()
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
     else:
-        agent = Five9APIAgent(username, password)
-    DOMAIN_ID = agent.domain_id
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
     skills = agent.get_skills()
+    journal = agent.get_journal("whisper", resume)
     fields = ['text','verbiage','description']
     #create whisper prompt csv
     with open(outfile, 'w', newline='') as csvfile:
@@ -517,17 +1775,53 @@ def whisper(username, password, out):
         
         csvfile.close()
     
-    #upload prompts
-    input(f"Press any key once you have uploaded {outfile} to the domain")
+    #upload prompts, a resumed run has already had them uploaded
+    if not journal.finished:
+        input(f"Press any key once you have uploaded {outfile} to the domain")
 
     #assign prompts to skills
-    for skill in skills:
-        if skill.get_prompt_id():
-            if skill.assign_whisper_prompt():
-                click.echo(f"Successfully assigned {skill.prompt_name} to {skill.name}")
-            else:
-                click.echo(f"Error: Problem assigning {skill.prompt_name} to {skill.name}")
+    prompts = agent.get_prompt_index()
+    def assign_prompt(skill):
+        if not skill.get_prompt_id(prompts):
+            return False
+        if skill.assign_whisper_prompt():
+            click.echo(f"Successfully assigned {skill.prompt_name} to {skill.name}")
+            return True
+        click.echo(f"Error: Problem assigning {skill.prompt_name} to {skill.name}")
+        return False
         #skill.set_routevm()
+    try:
+        results = run_bulk(skills, assign_prompt, workers, journal=journal)
+    finally:
+        journal.close()
+    print_bulk_summary(results, "Assigned whisper prompts to")
+
+@cli.command()
+@click.option('--username', type=click.STRING)
+@click.option('--password', type=click.STRING)
+@click.option('--out', "-o", default=None, type=click.Path(dir_okay=False), help="SQLite file to write, defaults to a file per domain in ~/.five9-vcc-tools")
+@click.option('--only', multiple=True, type=click.Choice(SNAPSHOT_KINDS), help="Refreshes only this kind of entity, may be repeated")
+@click.option('--full', default=False, is_flag=True, help="Refetches and rewrites every entity instead of only the changed ones")
+@click.option('--workers', "-w", default=WORKERS, type=click.IntRange(min=1), help="Number of definitions fetched at once")
+def snapshot(username, password, out, only, full, workers):
+    """Saves the domain configuration to a local SQLite database"""
+    if username == None or password == None:
+        agent=Five9APIAgent(pool_size=max(POOL_SIZE, workers))
+    else:
+        agent = Five9APIAgent(username, password, pool_size=max(POOL_SIZE, workers))
+    path = out or os.path.join(CACHE_DIR, f"snapshot-{agent.domain_id}.sqlite")
+    store = DomainSnapshot(path)
+    summary = snapshot_domain(agent, store, only or SNAPSHOT_KINDS, workers, full)
+    store.close()
+    click.echo(f"Snapshot of {agent.domain_name} saved to {path}")
+    for kind, counts in summary.items():
+        if counts is None:
+            click.echo(f"  {kind}: failed")
+            continue
+        details = ", ".join(f"{count} {label}" for label, count in counts.items() if label != "total")
+        click.echo(f"  {kind}: {counts['total']} ({details})")
+    if any(counts is None or counts["errors"] for counts in summary.values()):
+        click.echo("Error: The snapshot is incomplete and was not stamped as taken, run snapshot again to fetch what is missing")
 
 #Helper functions 
 def auth(username, password) -> Five9APIAgent:
@@ -538,12 +1832,323 @@ def auth(username, password) -> Five9APIAgent:
     return agent
 
 def get_auth():
-    auth = HTTPBasicAuth(input("Username:"), getpass())
+    auth = requests_auth.HTTPBasicAuth(input("Username:"), getpass.getpass())
     return auth
 
-def create_audio_issue_connector(name, agent : Five9APIAgent, id_agent_name, id_ani, id_dnis, id_call_id, id_session_id, id_campaign, id_number1):
-    url = f"{URL_REST}/{agent.domain_id}/web-connectors"
+def parse_variable(value):
+    """splits a "type:name" --addvariable value, raising click.BadParameter for unsupported types"""
+    type, separator, name = value.partition(":")
+    if not separator or not name:
+        raise click.BadParameter(f"\"{value}\" is not in the format \"type:name\"")
+    if type not in ("str", "string", "int", "integer"):
+        raise click.BadParameter(f"unsupported variable type \"{type}\", use string or integer")
+    return type, name
+
+def run_bulk(items, operation, workers=WORKERS, key=lambda item: item.name, journal=None) -> dict:
+    """
+    Runs operation against every item on a bounded thread pool
+
+    :param items: entities to process
+    :param operation: callable taking one item, a falsy return value counts as a failure and UNCHANGED as a skip
+    :param workers: maximum number of operations in flight at once
+    :param journal: optional BulkJournal, items it lists as finished are skipped and every outcome is appended to it
+    :return: dictionary of key(item) -> (success, error message, UNCHANGED, NOT_ATTEMPTED or RESUMED)
+    """
+    results = {}
+    stopped = threading.Event() #set once the API is known to be down or the run is interrupted so queued items are not attempted
+
+    def guarded(item):
+        if stopped.is_set():
+            return NOT_ATTEMPTED
+        try:
+            result = operation(item)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if journal is not None:
+                journal.record(key(item), False, str(e))
+            raise
+        #recorded by the worker so operations still in flight when the run is interrupted are not lost
+        if journal is not None:
+            journal.record(key(item), bool(result), None if result else "failed")
+        return result
 
+    with concurrent_futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for item in items:
+            if journal is not None and key(item) in journal.finished:
+                results[key(item)] = (True, RESUMED)
+                continue
+            futures[pool.submit(guarded, item)] = key(item)
+        try:
+            collect_bulk_results(futures, results, stopped)
+        except KeyboardInterrupt:
+            stopped.set()
+            click.echo("Interrupted, waiting for the operations in flight to finish" +
+                       (", run the command again with --resume to continue" if journal is not None else ""))
+            raise
+    return results
+
+def collect_bulk_results(futures, results, stopped):
+    """records the outcome of every future from run_bulk as it completes"""
+    for future in concurrent_futures.as_completed(futures):
+        try:
+            result = future.result()
+            if result is NOT_ATTEMPTED:
+                results[futures[future]] = (False, NOT_ATTEMPTED)
+            else:
+                results[futures[future]] = (bool(result), UNCHANGED if result is UNCHANGED else None)
+        except CircuitOpenError as e:
+            results[futures[future]] = (False, str(e))
+            if not stopped.is_set():
+                stopped.set()
+                click.echo(f"Error: {e}, stopping")
+        except Exception as e:
+            click.echo(f"Error: {futures[future]}: {e}")
+            results[futures[future]] = (False, str(e))
+
+def print_bulk_summary(results, action):
+    """Prints the totals from run_bulk and lists every item that failed"""
+    failed = sorted(key for key, (success, error) in results.items() if not success and error is not NOT_ATTEMPTED)
+    unchanged = sum(1 for success, error in results.values() if error is UNCHANGED)
+    skipped = sum(1 for success, error in results.values() if error is NOT_ATTEMPTED)
+    resumed = sum(1 for success, error in results.values() if error is RESUMED)
+    BULK_SUMMARIES.append({"action": action, "total": len(results), "succeeded": len(results) - len(failed) - skipped,
+                           "unchanged": unchanged, "not_attempted": skipped, "failed": len(failed), "resumed": resumed})
+    click.echo(f"{action} {len(results) - len(failed) - skipped}/{len(results)} successfully ({unchanged} already up to date"
+               + (f", {resumed} done in an earlier run" if resumed else "") + ")")
+    if skipped:
+        click.echo(f"  {skipped} not attempted because the API was unavailable")
+    for key in failed:
+        error = results[key][1]
+        click.echo(f"  Failed: {key}" + (f" ({error})" if error else ""))
+
+def read_domains(path) -> list:
+    """returns a dictionary of name, username and password for every row of a --domains file, name defaults to the username"""
+    with open(path, newline='') as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    if rows and not {"username", "password"} <= set(rows[0]):
+        click.echo(f"Error: {path} needs username and password columns")
+        exit(1)
+    domains, folders = [], set()
+    for row in rows:
+        if not row.get("username"):
+            continue
+        name = (row.get("name") or row["username"]).strip()
+        folder = re.sub(r"[^\w.-]+", "_", name)
+        while folder in folders:
+            folder += "_"
+        folders.add(folder)
+        #absolute so a worker process reused for another domain does not nest folders
+        domains.append({"name": name, "username": row["username"].strip(), "password": row["password"],
+                        "folder": os.path.abspath(os.path.join(DOMAINS_DIR, folder))})
+    return domains
+
+def strip_options(args, options):
+    """returns args without the options given and their values"""
+    stripped = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(f"{option}=") for option in options):
+            stripped.append(arg)
+    return stripped
+
+def run_domain(domain, args) -> dict:
+    """
+    Runs the command line for a single domain, called in a worker process by run_domains
+
+    The domain works in its own folder under DOMAINS_DIR with its credentials in the environment, so its
+    backups, failed updates and output never mix with another domain's. Everything it prints is
+    captured and saved to output.log in that folder.
+    """
+    folder = domain['folder']
+    os.makedirs(folder, exist_ok=True)
+    os.chdir(folder)
+    os.environ["VCC-Username"] = domain['username']
+    os.environ["VCC-Password"] = domain['password']
+    del BULK_SUMMARIES[:]
+    output = io.StringIO()
+    start = time.monotonic()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            cli.main(args=args, prog_name="app.py", standalone_mode=False)
+            code = 0
+        except click.exceptions.Exit as e:
+            code = e.exit_code
+        except click.ClickException as e:
+            e.show()
+            code = e.exit_code
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+    with open("output.log", "w") as log:
+        log.write(output.getvalue())
+    return {"name": domain['name'], "folder": folder, "exit_code": code, "seconds": time.monotonic() - start,
+            "summaries": list(BULK_SUMMARIES), "output": output.getvalue()}
+
+def run_domains(domains, args, processes=DOMAIN_PROCESSES, verbose=False) -> int:
+    """runs the command line for every domain in a pool of processes, prints the merged report and returns the exit code"""
+    if not domains:
+        click.echo("Error: No domains to run")
+        return 1
+    click.echo(f"Running \"{' '.join(args)}\" across {len(domains)} domains, {min(processes, len(domains))} at a time")
+    results = []
+    with concurrent_futures.ProcessPoolExecutor(max_workers=min(processes, len(domains))) as pool:
+        futures = {pool.submit(run_domain, domain, args): domain for domain in domains}
+        for future in concurrent_futures.as_completed(futures):
+            domain = futures[future]
+            try:
+                result = future.result()
+            except Exception as e: #the worker process itself died
+                result = {"name": domain['name'], "folder": domain['folder'], "exit_code": 1,
+                          "seconds": 0, "summaries": [], "output": f"Error: {e}\n"}
+            results.append(result)
+            click.echo(f"{result['name']}: {'done' if result['exit_code'] == 0 else 'failed'} in {result['seconds']:.1f}s")
+    print_domain_report(results, verbose)
+    return 0 if all(result['exit_code'] == 0 for result in results) else 1
+
+def print_domain_report(results, verbose=False):
+    """Prints every domain's bulk totals, the output of failed domains and the totals across all of them"""
+    totals = {}
+    click.echo("\nDomain results")
+    for result in sorted(results, key=lambda result: result['name']):
+        status = "ok" if result['exit_code'] == 0 else f"failed (exit code {result['exit_code']})"
+        click.echo(f"  {result['name']}: {status} in {result['seconds']:.1f}s, output in {os.path.relpath(os.path.join(result['folder'], 'output.log'))}")
+        for summary in result['summaries']:
+            click.echo(f"    {summary['action']} {summary['succeeded']}/{summary['total']} successfully ({summary['unchanged']} already up to date)"
+                       + (f", {summary['failed']} failed" if summary['failed'] else ""))
+            total = totals.setdefault(summary['action'], {"domains": 0, "total": 0, "succeeded": 0, "unchanged": 0, "not_attempted": 0, "failed": 0})
+            total['domains'] += 1
+            for key in ("total", "succeeded", "unchanged", "not_attempted", "failed"):
+                total[key] += summary[key]
+        if result['exit_code'] != 0 or verbose:
+            lines = result['output'].strip().splitlines()
+            for line in lines[-20:] if not verbose else lines:
+                click.echo(f"    | {line}")
+    succeeded = sum(1 for result in results if result['exit_code'] == 0)
+    click.echo(f"\n{succeeded}/{len(results)} domains completed successfully")
+    for action, total in totals.items():
+        click.echo(f"  {action} {total['succeeded']}/{total['total']} successfully ({total['unchanged']} already up to date) across {total['domains']} domains"
+                   + (f", {total['failed']} failed" if total['failed'] else "")
+                   + (f", {total['not_attempted']} not attempted" if total['not_attempted'] else ""))
+
+class TaskGraph:
+    """
+    Runs named steps on a thread pool as soon as the steps before them have finished
+
+    A step fails when its function raises. Steps listed in requires must succeed, a failure skips every
+    step that requires it. Steps listed in after only have to finish first, whatever their outcome.
+    """
+    def __init__(self, workers=WORKERS) -> None:
+        self.workers = workers
+        self.tasks = {} #name -> (function, requires, after)
+        self.results = {} #name -> return value of the step
+        self.status = {} #name -> ok, failed or skipped
+        self.errors = {}
+        self.timings = {} #name -> seconds the step took
+        self.elapsed = 0
+
+    def add(self, name, function, requires=(), after=()):
+        """adds a step, every step it depends on must already have been added"""
+        for dependency in (*requires, *after):
+            if dependency not in self.tasks:
+                raise ValueError(f"Step {name} depends on unknown step {dependency}")
+        self.tasks[name] = (function, tuple(requires), tuple(after))
+
+    def run_step(self, name):
+        function = self.tasks[name][0]
+        start = time.perf_counter()
+        try:
+            self.results[name] = function()
+            self.status[name] = "ok"
+        except Exception as e:
+            self.errors[name] = str(e)
+            self.status[name] = "failed"
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def run(self) -> bool:
+        """runs every step and returns True if none of them failed or were skipped"""
+        start = time.perf_counter()
+        pending = list(self.tasks)
+        running = set()
+        with concurrent_futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    function, requires, after = self.tasks[name]
+                    if any(dependency not in self.status for dependency in (*requires, *after)):
+                        continue
+                    pending.remove(name)
+                    failed = [dependency for dependency in requires if self.status[dependency] != "ok"]
+                    if failed:
+                        self.status[name] = "skipped"
+                        self.errors[name] = f"requires {', '.join(failed)}"
+                        self.timings[name] = 0
+                    else:
+                        running.add(pool.submit(self.run_step, name))
+                if not running:
+                    continue #skipping a step may have released others, check again before waiting
+                done, running = concurrent_futures.wait(running, return_when=concurrent_futures.FIRST_COMPLETED)
+        self.elapsed = time.perf_counter() - start
+        return all(status == "ok" for status in self.status.values())
+
+    def print_report(self):
+        """prints the outcome and duration of every step"""
+        for name in self.tasks:
+            error = self.errors.get(name)
+            click.echo(f"  {self.status[name]:<8} {self.timings[name]:6.2f}s  {name}" + (f" ({error})" if error else ""))
+        ok = sum(1 for status in self.status.values() if status == "ok")
+        click.echo(f"Completed {ok}/{len(self.tasks)} steps in {self.elapsed:.2f}s ({sum(self.timings.values()):.2f}s of calls)")
+
+def expect_success(response):
+    """returns the response if it succeeded, raises so TaskGraph records the step as failed otherwise"""
+    if not response_error_handler(response):
+        raise RuntimeError(f"{response.status_code} {response.reason}")
+    return response
+
+AUDIO_ISSUE_CONTACT_FIELDS = [("Agent Name","STRING"), ("ANI","STRING"), ("DNIS","STRING"), ("Call_ID","STRING"), ("Session_ID","STRING"),
+                              ("Campaign","STRING"), ("Quality Issue","STRING"), ("Create_Date","DATE_TIME")]
+AUDIO_ISSUE_CALL_VARIABLES = ["Customer.Agent Name", "Call.ANI", "Call.DNIS", "Call.call_id", "Call.session_id", "Call.campaign_name", "Customer.number1"]
+AUDIO_ISSUE_CONNECTORS = ["Dead Air", "One Way Audio", "Dropped Call"]
+
+def audio_issue_plan(agent, workers=WORKERS) -> TaskGraph:
+    """
+    Describes the troubleshoot --audio provisioning as a TaskGraph
+
+    The list and contact fields are independent of each other. Call variables are looked up once every
+    contact field has been attempted (Customer.Agent Name comes from the Agent Name field) and the
+    connectors need those ids, so the run takes about as long as its longest chain of calls.
+    """
+    plan = TaskGraph(workers)
+    plan.add("Create list Quality Issues", lambda: expect_success(agent.create_list("Quality Issues")))
+    fields = []
+    for field, dataType in AUDIO_ISSUE_CONTACT_FIELDS:
+        fields.append(f"Create contact field {field}")
+        plan.add(fields[-1], lambda field=field, dataType=dataType: expect_success(agent.create_contact_field(field, "HIDDEN", dataType)))
+
+    def get_call_variable_ids():
+        ids = {name: agent.get_cav_id(name) for name in AUDIO_ISSUE_CALL_VARIABLES}
+        missing = [name for name, id in ids.items() if id is None]
+        if missing:
+            raise RuntimeError(f"call variables not found: {', '.join(missing)}")
+        return ids
+    plan.add("Look up call variables", get_call_variable_ids, after=fields)
+
+    def create_connector(name):
+        ids = plan.results["Look up call variables"]
+        return expect_success(create_audio_issue_connector(name, agent, *(ids[variable] for variable in AUDIO_ISSUE_CALL_VARIABLES)))
+    for name in AUDIO_ISSUE_CONNECTORS:
+        plan.add(f"Create connector {name}", lambda name=name: create_connector(name),
+                 requires=["Look up call variables"], after=["Create list Quality Issues"])
+    return plan
+
+def create_audio_issue_connector(name, agent : Five9APIAgent, id_agent_name, id_ani, id_dnis, id_call_id, id_session_id, id_campaign, id_number1):
     payload = json.dumps({"name": name,"description": "",
     "url": {"pathParams": [{"type": "CONSTANT", "value": "https://api.five9.com/web2campaign/AddToList"}],
         "queryParams": [
@@ -616,13 +2221,375 @@ def create_audio_issue_connector(name, agent : Five9APIAgent, id_agent_name, id_
     "browserWindowType": "CURRENT_BROWSER_WINDOW",
     "kind": "CONNECTOR"
     })
-    headers = {'Content-Type': 'application/json','Accept': 'application/json'}
-
-    response = requests.request("POST", url, auth=agent.auth, headers=headers, data=payload)
+    response = agent.session.rest("POST", f"/{agent.domain_id}/web-connectors", data=payload)
     response_error_handler(response)
     return response
 
-def xml_add_variable(parent, name, type, input: bool, output: bool) -> ET.Element:
+def entity_digest(entity):
+    return hashlib.sha256(json.dumps(entity, sort_keys=True).encode("utf-8")).hexdigest()
+
+def snapshot_domain(agent, store, kinds=SNAPSHOT_KINDS, workers=WORKERS, full=False) -> dict:
+    """
+    Sweeps every kind of entity into the DomainSnapshot concurrently
+
+    Lists are always read in full, only new and changed entities are written and missing ones deleted.
+    Campaign and script definitions are fetched every time, as editing one leaves its list entity as it
+    was, and only rewritten when their digest changed.
+
+    :param kinds: tables to refresh, see SNAPSHOT_KINDS
+    :param full: refetches and rewrites every entity even if it looks unchanged
+    :return: dictionary of kind -> counts of total, added, changed, removed and errors, None for kinds that failed
+    """
+    def sweep(table, entities, row):
+        """
+        writes new and changed entities and removes missing ones
+
+        Nothing is written or removed unless entities is listed to the end, a page that could not be retrieved raises
+        ListingError so a partial list never deletes the rows it missed.
+        """
+        existing = store.digests(table)
+        counts = {"total": 0, "added": 0, "changed": 0, "removed": 0, "errors": 0}
+        rows, seen = [], set()
+        now = time.time()
+        for entity in entities:
+            values = row(entity)
+            values.update(entity=json.dumps(entity), digest=entity_digest(entity), refreshed=now)
+            seen.add(values['id'])
+            counts["total"] += 1
+            if full or existing.get(values['id']) != values['digest']:
+                counts["changed" if values['id'] in existing else "added"] += 1
+                rows.append(values)
+        store.write(table, rows)
+        removed = existing.keys() - seen
+        store.delete(table, removed)
+        counts["removed"] = len(removed)
+        return counts
+
+    def snapshot_campaigns():
+        entities = list(agent.get_campaigns())
+        counts = sweep("campaigns", entities, lambda campaign: {"id": str(campaign['id']), "name": campaign.get('name'), "type": campaign.get('type')})
+        stored = store.digests("campaigns", "definition_digest")
+        counts["definitions updated"] = 0
+        counts_lock = threading.Lock()
+        def get_definition(campaign):
+            id = str(campaign['id'])
+            type = (campaign.get('type') or "inbound").lower()
+            response = agent.session.rest("GET", f"/{agent.domain_id}/campaigns/{type}_campaigns/{id}")
+            if not response_error_handler(response):
+                return False
+            with profiled("parse"):
+                definition = json.loads(response.text)
+            digest = entity_digest(definition)
+            if full or stored.get(id) != digest:
+                store.update("campaigns", id, definition=json.dumps(definition), definition_digest=digest, refreshed=time.time())
+                with counts_lock:
+                    counts["definitions updated"] += 1
+            return True
+        results = run_bulk(entities, get_definition, workers, key=lambda campaign: str(campaign['id']))
+        counts["errors"] += sum(not success for success, error in results.values())
+        return counts
+
+    def snapshot_scripts():
+        entities = agent.get_ivrs()
+        counts = sweep("scripts", entities, lambda script: {"id": str(script.get('id', script['name'])), "name": script['name']})
+        #the definitions can only be compared once fetched, they are written one batch at a time to bound memory
+        ids = {script['name']: str(script.get('id', script['name'])) for script in entities}
+        stored = store.digests("scripts", "definition_digest")
+        batch = Five9IVRBatch(agent.session, list(ids), IVR_BATCH_SIZE)
+        counts["definitions updated"] = 0
+        counts_lock = threading.Lock()
+        def fetch_chunk(index):
+            definitions = batch.fetch(index)
+            if definitions is None:
+                click.echo(f"Error: Problem Retrieving Script Batch {index}")
+                return False
+            now = time.time()
+            for name, (root, digest) in definitions.items():
+                if name in ids and (full or stored.get(ids[name]) != digest):
+                    with profiled("serialize"):
+                        definition = gzip.compress(etree.tostring(root, encoding="utf-8"))
+                    store.update("scripts", ids[name], definition=definition, definition_digest=digest, refreshed=now)
+                    with counts_lock:
+                        counts["definitions updated"] += 1
+            return True
+        results = run_bulk(range(len(batch.chunks)), fetch_chunk, workers, key=lambda index: index)
+        counts["errors"] += sum(not success for success, error in results.values())
+        return counts
+
+    sweeps = {
+        "skills": lambda: sweep("skills", agent.paginate(f"/{agent.domain_id}/skills"), lambda skill: {"id": str(skill['id']), "name": skill['name']}),
+        "prompts": lambda: sweep("prompts", agent.paginate(f"/{agent.domain_id}/prompts"), lambda prompt: {"id": str(prompt['id']), "name": prompt['name']}),
+        "call_variables": lambda: sweep("call_variables", agent.paginate(f"/{agent.domain_id}/call-variables"),
+                                        lambda variable: {"id": str(variable['id']), "name": variable.get('fullName')}),
+        "campaigns": snapshot_campaigns,
+        "scripts": snapshot_scripts,
+    }
+    with concurrent_futures.ThreadPoolExecutor(max_workers=len(kinds)) as pool:
+        futures = {kind: pool.submit(sweeps[kind]) for kind in kinds}
+    summary = {}
+    for kind, future in futures.items():
+        try:
+            summary[kind] = future.result()
+        except (OSError, sqlite3.Error, KeyError, ValueError, CircuitOpenError, ListingError) as e:
+            #requests errors are OSErrors, KeyError and ValueError come from malformed entities
+            click.echo(f"Error: Problem taking snapshot of {kind}: {e!r}")
+            summary[kind] = None
+    store.set_meta(domain_id=agent.domain_id, domain_name=agent.domain_name)
+    #only a snapshot every kind was refreshed into without errors is stamped as taken
+    if all(counts is not None and not counts["errors"] for counts in summary.values()):
+        store.set_meta(taken=time.time())
+    return summary
+
+def refresh_ivr_index(agent, index, workers=WORKERS, snapshot=None) -> dict:
+    """
+    Re-indexes every script whose definition changed since it was indexed and drops deleted scripts
+
+    :param snapshot: DomainSnapshot to read the definitions from instead of the API
+    :return: counts of scripts total, indexed and removed
+    :raises ListingError: if the list of scripts could not be read in full, the index is left as it was
+    """
+    indexed = index.digests()
+    counts = {"total": 0, "indexed": 0, "removed": 0}
+    counts_lock = threading.Lock()
+
+    def add(name, root, digest):
+        index.add(name, root, digest)
+        with counts_lock:
+            counts["indexed"] += 1
+
+    if snapshot is not None:
+        current = snapshot.script_digests()
+        for name, digest in current.items():
+            if digest is None:
+                #listed but its definition was never fetched, whatever the index holds for it is kept
+                if name in indexed:
+                    current[name] = indexed[name]
+                continue
+            if indexed.get(name) != digest:
+                add(name, snapshot.script_definition(name), digest)
+    else:
+        current = {}
+        #scripts are only dropped from the index once the whole list has been read, get_ivrs raises on a failed page
+        names = [ivr['name'] for ivr in agent.get_ivrs()]
+        batch = Five9IVRBatch(agent.session, names, IVR_BATCH_SIZE)
+        def fetch_chunk(chunk):
+            definitions = batch.fetch(chunk)
+            if definitions is None:
+                click.echo(f"Error: Problem Retrieving Script Batch {chunk}")
+                return False
+            for name, (root, digest) in definitions.items():
+                current[name] = digest
+                if indexed.get(name) != digest:
+                    add(name, root, digest)
+            return True
+        results = run_bulk(range(len(batch.chunks)), fetch_chunk, workers, key=lambda chunk: chunk)
+        if not all(success for success, error in results.values()):
+            current.update({name: indexed[name] for name in names if name in indexed and name not in current})
+    removed = indexed.keys() - current.keys()
+    index.remove(removed)
+    counts["total"] = sum(digest is not None for digest in current.values())
+    counts["removed"] = len(removed)
+    return counts
+
+def find_ivr_backups(store, names=(), before=None) -> list:
+    """
+    Returns an IVRDefinitionFile for the newest backup of every script in the store
+
+    :param store: IVRBackupStore of the backup folder, <script>.xml files in the folder itself are backups taken by older versions
+    :param names: only these scripts, every script if empty
+    :param before: aware datetime, backups taken at or after it are ignored
+    """
+    newest = {}
+    def consider(backup):
+        if names and backup.name not in names:
+            return
+        if before is not None and backup.time >= before:
+            return
+        if backup.name not in newest or backup.time > newest[backup.name].time:
+            newest[backup.name] = backup
+
+    for entry in store.history():
+        time = datetime.fromisoformat(entry['time'])
+        consider(IVRDefinitionFile(entry['script'], f"{entry['script']} ({entry['time']})", digest=entry['digest'], store=store, time=time))
+    with os.scandir(store.path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".xml"):
+                time = datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc)
+                #written by older versions under the script's own name, never % encoded
+                consider(IVRDefinitionFile(entry.name[:-len(".xml")], entry.path, path=entry.path, time=time))
+    return [newest[name] for name in sorted(newest)]
+
+def find_failed_updates(path=FAILED_DIR, names=()):
+    """yields an IVRDefinitionFile for every <script>.xml file in the folder"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(".xml"):
+                continue
+            name = script_from_filename(entry.name)
+            if not names or name in names:
+                yield IVRDefinitionFile(name, entry.path, path=entry.path)
+
+def script_filename(name) -> str:
+    """returns <name>.xml with % and the characters file names can not hold, such as /, written as %XX"""
+    return re.sub(r'[%/\\:*?"<>|\x00-\x1f]', lambda match: f"%{ord(match.group()):02X}", name) + ".xml"
+
+def script_from_filename(filename) -> str:
+    """returns the script name script_filename was given, only for files it named"""
+    return re.sub(r"%([0-9A-F]{2})", lambda match: chr(int(match.group(1), 16)), filename[:-len(".xml")])
+
+def push_ivr_definitions(agent, definitions, workers=WORKERS, dry_run=False, remove=False) -> dict:
+    """
+    Validates every definition and uploads it over the script it belongs to with modifyIVRScript
+
+    :param definitions: IVRDefinitionFile iterable, may be a generator
+    :param dry_run: only loads and validates the definitions
+    :param remove: deletes the file of every definition uploaded successfully
+    :return: run_bulk results keyed by the label of each definition
+    """
+    scripts = {ivr['name'] for ivr in agent.get_ivrs(fields="name")}
+    def push(definition):
+        root = definition.load()
+        if definition.name not in scripts:
+            raise ValueError(f"there is no script called {definition.name} in the domain")
+        if dry_run:
+            if VERBOSE:
+                click.echo(f"{definition.label} is a valid definition of {definition.name}")
+            return True
+        response = Five9IVR(agent.session, definition.name).modifyScript(root)
+        if not response_error_handler(response):
+            click.echo(f"Error: Problem Updating Script: {definition.name}")
+            return False
+        click.echo(f"Uploaded {definition.label} to {definition.name}")
+        if remove:
+            os.remove(definition.path)
+        return response
+    return run_bulk(definitions, push, workers, key=lambda definition: definition.label)
+
+def parse_ivr_definition(data):
+    """
+    Parses a saved xmlDefinition and returns its root element, raises ValueError if it is not an ivr script
+
+    Older versions of this tool saved failed updates with every < written as &lt;, those are read too.
+    """
+    data = data.strip()
+    if data.startswith(b"&lt;"):
+        data = data.replace(b"&lt;", b"<")
+    if not data:
+        raise ValueError("the file is empty")
+    try:
+        root = etree.fromstring(data, etree.XMLParser(huge_tree=True, resolve_entities=False, no_network=True))
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f"not valid xml: {e}")
+    if root.tag != "ivrScript" or root.find('modules') is None:
+        raise ValueError(f"not an ivr script definition, the root element is <{root.tag}>")
+    return root
+
+def fetch_ivr_scripts(session, pattern):
+    """calls the getIVRScripts api with a name pattern and returns the response"""
+    payload = f"<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" xmlns:ser=\"http://service.admin.ws.five9.com/\">\r\n   <soapenv:Header/>\r\n   <soapenv:Body>\r\n      <ser:getIVRScripts>\r\n         <!--Optional:-->\r\n         <namePattern>{saxutils.escape(pattern)}</namePattern>\r\n      </ser:getIVRScripts>\r\n   </soapenv:Body>\r\n</soapenv:Envelope>"
+    response = session.soap(payload, "getIVRScripts", stream=True) #body is read incrementally by parse_ivr_scripts
+    if response.status_code != 200:
+        response.content #read the error body so the connection goes back to the pool
+    return response
+
+class XMLEscapingWriter:
+    """file like object that escapes everything written to it so it can be embedded as text in another xml document"""
+    def __init__(self, out) -> None:
+        self.out = out
+
+    def write(self, data):
+        self.out.write(data.replace(b"&", b"&amp;").replace(b"<", b"&lt;").replace(b">", b"&gt;"))
+        return len(data)
+
+def modify_ivr_script_envelope(name, root) -> io.BytesIO:
+    """
+    Builds the modifyIVRScript request body
+
+    lxml serializes the definition in small pieces straight through XMLEscapingWriter into one buffer,
+    so the only full size copy of the script is the request body itself.
+
+    :param name: name of the script being updated
+    :param root: root element of the new xmlDefinition
+    :return: buffer positioned at the start, requests streams it as the request body
+    """
+    body = io.BytesIO()
+    body.write(("<soapenv:Envelope xmlns:soapenv=\"http://schemas.xmlsoap.org/soap/envelope/\" xmlns:ser=\"http://service.admin.ws.five9.com/\">\r\n   <soapenv:Header/>\r\n   <soapenv:Body>\r\n      <ser:modifyIVRScript>\r\n       <scriptDef>\r\n            "
+                f"<name>{saxutils.escape(name)}</name>\r\n            <xmlDefinition>").encode("utf-8"))
+    etree.ElementTree(root).write(XMLEscapingWriter(body), encoding="utf-8", xml_declaration=False)
+    body.write(b"</xmlDefinition>\r\n         </scriptDef>\r\n      </ser:modifyIVRScript>\r\n   </soapenv:Body>\r\n</soapenv:Envelope>")
+    body.seek(0)
+    return body
+
+class IVRScriptsTarget:
+    """
+    lxml parser target for getIVRScripts responses
+
+    The envelope is never built as a tree. Text inside each xmlDefinition is fed straight into a
+    second parser as it arrives so the only thing kept in memory is the ivr element tree itself.
+    """
+    def __init__(self) -> None:
+        self.scripts = {}
+        self.depth = 0
+        self.return_depth = None #depth of the <return> element currently being read
+        self.field = None
+        self.name = []
+        self.root = None
+        self.parser = None #parser for the xmlDefinition currently being read
+        self.digest = None #sha256 of the xmlDefinition text, updated as it is fed to the parser
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        tag = etree.QName(tag).localname
+        if tag == "return":
+            self.return_depth = self.depth
+            self.name = []
+            self.root = None
+        elif self.return_depth is not None and self.depth == self.return_depth + 1:
+            if tag == "name":
+                self.field = "name"
+            elif tag == "xmlDefinition":
+                self.field = "xmlDefinition"
+                self.parser = etree.XMLParser(huge_tree=True)
+                self.digest = hashlib.sha256()
+
+    def data(self, data):
+        if self.field == "name":
+            self.name.append(data)
+        elif self.field == "xmlDefinition":
+            data = data.encode("utf-8")
+            self.digest.update(data)
+            self.parser.feed(data)
+
+    def end(self, tag):
+        if self.field == "xmlDefinition":
+            try:
+                self.root = self.parser.close()
+            except etree.XMLSyntaxError:
+                self.root = None #empty or malformed definition, the script is reported as not found
+            self.parser = None
+        elif self.depth == self.return_depth:
+            if self.root is not None:
+                self.scripts["".join(self.name)] = (self.root, self.digest.hexdigest())
+            self.return_depth = None
+            self.root = None
+        self.field = None
+        self.depth -= 1
+
+    def close(self):
+        return self.scripts
+
+def parse_ivr_scripts(response) -> dict:
+    """returns a dictionary of script name -> (xmlDefinition root element, sha256 of the definition), parsed while the response streams in"""
+    parser = etree.XMLParser(target=IVRScriptsTarget(), huge_tree=True)
+    try:
+        with profiled("parse"):
+            for chunk in response.iter_content(STREAM_CHUNK):
+                parser.feed(chunk)
+            return parser.close()
+    finally:
+        response.close()
+
+def xml_add_variable(parent, name, type, input: bool, output: bool) -> etree._Element:
     """
     Adds script variable with type string to the script
 
@@ -656,8 +2623,8 @@ def xml_add_variable(parent, name, type, input: bool, output: bool) -> ET.Elemen
     xml_add_sub_element(newValue, 'isNullValue', 'true')
     return newEntry
 
-def xml_add_sub_element(parent, tag, text) -> ET.Element:
-	newElement = ET.SubElement(parent, tag)
+def xml_add_sub_element(parent, tag, text) -> etree._Element:
+	newElement = etree.SubElement(parent, tag)
 	newElement.text = text
 	return newElement
 
@@ -0,0 +1,346 @@
+"""
+Purpose: Local stand-in for the parts of the Five9 REST and SOAP admin APIs used by app.py, so the tool can be
+measured without a live tenant.
+
+Usage:
+    python benchmarks/mock_five9.py --port 8700 --ivrs 1000 --modules 2000 --skills 5000 --latency 0.05
+
+Point app.py at it with the VCC-REST-URL and VCC-SOAP-URL environment variables:
+    VCC-REST-URL=http://127.0.0.1:8700/restadmin/api/v1/domains
+    VCC-SOAP-URL=http://127.0.0.1:8700/wsadmin/v12/AdminWebService
+
+Responses of 1KB or more are gzip compressed for clients that send Accept-Encoding: gzip, and gzip request bodies
+are accepted unless --reject-compressed is given.
+
+GET /__stats returns the requests served since the last POST /__reset, POST /__reset?data=1 also discards every
+change made to the synthetic domain.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import gzip
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+import lxml.etree as etree
+
+REST_PREFIX = "/restadmin/api/v1/domains/"
+SOAP_PATH = "/wsadmin/v12/AdminWebService"
+DOMAIN_ID = "1000"
+DOMAIN_NAME = "Mock Domain"
+MODULE_TYPES = ["play", "menu", "skillTransfer", "query", "ifElse", "setVariable", "hangup"]
+CALL_VARIABLES = ["Call.ANI", "Call.DNIS", "Call.call_id", "Call.session_id", "Call.campaign_name", "Call.skill_name",
+                  "Customer.number1", "Customer.first_name", "Customer.last_name"]
+SOAP_ENVELOPE = ('<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/"><env:Header/><env:Body>'
+                 '{}</env:Body></env:Envelope>')
+SOAP_FAULT = ('<env:Fault><faultcode>env:Server</faultcode><faultstring>{}</faultstring></env:Fault>')
+
+class MockDomain:
+    """Synthetic domain, generated deterministically from its size so every run sees the same data"""
+    def __init__(self, ivrs, modules, skills, campaigns, seed=0) -> None:
+        self.ivr_count = ivrs
+        self.module_count = modules
+        self.skill_count = skills
+        self.campaign_count = campaigns
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.skills = [{"id": str(100000 + i), "name": f"Skill {i}"} for i in range(self.skill_count)]
+            self.prompts = [{"id": str(200000 + i), "name": f"Whisper Skill {i}"} for i in range(self.skill_count)]
+            self.campaigns = [{"id": str(300000 + i), "name": f"Campaign {i}", "type": "INBOUND" if i % 5 else "OUTBOUND"}
+                              for i in range(self.campaign_count)]
+            self.scripts = [f"IVR Script {i}" for i in range(self.ivr_count)]
+            self.call_variables = [{"id": str(400000 + i), "fullName": name} for i, name in enumerate(CALL_VARIABLES)]
+            self.campaign_definitions = {} #id -> definition changed by a PUT
+            self.script_definitions = {} #name -> zlib compressed definition changed by modifyIVRScript
+            self.created = {"call-lists": [], "contact-fields": [], "web-connectors": []}
+
+    def script_xml(self, name) -> bytes:
+        """returns the current definition of the script"""
+        with self.lock:
+            if name in self.script_definitions:
+                return zlib.decompress(self.script_definitions[name])
+        index = self.scripts.index(name)
+        rng = random.Random(f"{self.seed}:{index}")
+        parts = [f"<ivrScript><domainId>{DOMAIN_ID}</domainId><properties/><modules>"]
+        ids = [f"{index:06d}-{i:06d}" for i in range(self.module_count)]
+        parts.append(f"<incomingCall><singleDescendant>{ids[1] if len(ids) > 1 else ''}</singleDescendant>"
+                     f"<moduleName>IncomingCall1</moduleName><locationX>0</locationX><locationY>0</locationY>"
+                     f"<moduleId>{ids[0]}</moduleId><data/></incomingCall>")
+        for i in range(1, self.module_count):
+            module = MODULE_TYPES[rng.randrange(len(MODULE_TYPES))]
+            name = f"{module.capitalize()}{i}"
+            if rng.random() < 0.1:
+                name = f"Copy of {name}"
+            if module == "skillTransfer":
+                data = f"<data><skill><id>{100000 + rng.randrange(max(1, self.skill_count))}</id><name>Skill {rng.randrange(max(1, self.skill_count))}</name></skill></data>"
+            elif module == "play":
+                data = f"<data><prompt><id>{200000 + i}</id><name>Whisper Skill {rng.randrange(max(1, self.skill_count))}</name></prompt></data>"
+            else:
+                data = f"<data><variableName>{CALL_VARIABLES[rng.randrange(len(CALL_VARIABLES))]}</variableName></data>"
+            descendant = ids[i + 1] if i + 1 < len(ids) else ""
+            parts.append(f"<{module}><ascendants>{ids[i - 1]}</ascendants><singleDescendant>{descendant}</singleDescendant>"
+                         f"<moduleName>{name}</moduleName><locationX>{i * 10}</locationX><locationY>{rng.randrange(1000)}</locationY>"
+                         f"<moduleId>{ids[i]}</moduleId>{data}</{module}>")
+        parts.append("</modules><modulesOnHangup/><userVariables>")
+        for i in range(3):
+            parts.append(f"<entry><key>Var{i}</key><value><name>Var{i}</name><description/><stringValue><value/><id>0</id>"
+                         f"</stringValue><attributes>64</attributes><isNullValue>true</isNullValue></value></entry>")
+        parts.append("</userVariables><multiLanguagesVariables/><languages/><multiLanguagesPrompts/></ivrScript>")
+        return "".join(parts).encode("utf-8")
+
+    def campaign_definition(self, id):
+        with self.lock:
+            if id in self.campaign_definitions:
+                return self.campaign_definitions[id]
+        entry = {"generalData": {"scriptParameters": [{"name": "existing", "value": {"type": "STRING", "secure": False, "value": "1"}}]}}
+        return {"id": id, "ivrSchedule": {"defaultScheduleEntry": entry, "customScheduleEntries": [json.loads(json.dumps(entry))]}}
+
+class Stats:
+    """Server side record of every request served"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = [] #(operation, status, seconds, bytes received, bytes sent)
+            self.in_flight = 0
+            self.peak_in_flight = 0
+
+    def to_json(self):
+        with self.lock:
+            return {"requests": list(self.requests), "peak_in_flight": self.peak_in_flight}
+
+class MockFive9Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    domain = None
+    stats = None
+    options = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_call("GET")
+
+    def do_POST(self):
+        self.handle_call("POST")
+
+    def do_PUT(self):
+        self.handle_call("PUT")
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        if len(body) >= 1024 and "gzip" in self.headers.get("Accept-Encoding", "") and not self.options.no_compression:
+            body = gzip.compress(body, 6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def handle_call(self, method):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        body = self.read_body()
+        received = len(body)
+        if self.headers.get("Content-Encoding", "").lower() == "gzip" and not self.options.reject_compressed:
+            body = gzip.decompress(body)
+        if url.path.startswith("/__"):
+            return self.handle_control(url)
+
+        stats = self.stats
+        with stats.lock:
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            throttled = self.options.throttle and stats.in_flight > self.options.throttle
+        try:
+            operation = self.operation(method, url.path, body)
+            if throttled:
+                status, sent = 429, self.send(429, "{}", headers={"Retry-After": str(self.options.retry_after)})
+            elif self.options.error_rate and random.random() < self.options.error_rate:
+                status, sent = 503, self.send(503, "{}")
+            else:
+                latency = self.options.soap_latency if url.path == SOAP_PATH else self.options.latency
+                if latency:
+                    time.sleep(random.uniform(latency * 0.5, latency * 1.5))
+                if url.path == SOAP_PATH:
+                    status, sent = self.handle_soap(operation, body)
+                else:
+                    status, sent = self.handle_rest(method, url, body)
+        finally:
+            with stats.lock:
+                stats.in_flight -= 1
+        with stats.lock:
+            stats.requests.append((operation, status, time.perf_counter() - start, received, sent))
+
+    def handle_control(self, url):
+        if url.path == "/__stats":
+            self.send(200, json.dumps(self.stats.to_json()))
+        elif url.path == "/__reset":
+            self.stats.reset()
+            if parse_qs(url.query).get("data"):
+                self.domain.reset()
+            self.send(200, "{}")
+        else:
+            self.send(404, "{}")
+
+    def operation(self, method, path, body):
+        """name used for this request in the statistics"""
+        if path == SOAP_PATH:
+            match = re.search(rb"<(?:\w+:)?(getVCCConfiguration|getIVRScripts|modifyIVRScript)\b", body[:2000])
+            return f"SOAP {match.group(1).decode() if match else 'unknown'}"
+        path = path[len(REST_PREFIX):] if path.startswith(REST_PREFIX) else path
+        path = "/".join("{id}" if part.isdigit() or part == "me" else part for part in path.split("/")[1:])
+        return f"{method} /{path}"
+
+    #REST
+    def page(self, entities, query):
+        filter = query.get("filter", [None])[0]
+        if filter:
+            match = re.match(r"""(\w+)==['"](.*)['"]$""", filter)
+            if match:
+                entities = [entity for entity in entities if str(entity.get(match.group(1))) == match.group(2)]
+        fields = query.get("fields", [None])[0]
+        limit = int(query.get("limit", ["100"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        page = entities[offset:offset + limit]
+        if fields:
+            keep = fields.split(",")
+            page = [{key: value for key, value in entity.items() if key in keep} for entity in page]
+        return {"entities": page, "resultsCount": len(page)}
+
+    def handle_rest(self, method, url, body):
+        if not url.path.startswith(REST_PREFIX):
+            return 404, self.send(404, "{}")
+        parts = url.path[len(REST_PREFIX):].split("/")[1:]
+        query = parse_qs(url.query)
+        domain = self.domain
+        collections = {"skills": domain.skills, "scripts": [{"id": name, "name": name} for name in domain.scripts],
+                       "campaigns": domain.campaigns, "prompts": domain.prompts, "call-variables": domain.call_variables,
+                       "users": [{"userName": "partition.admin", "partitionAdminRole": {}}]}
+        if method == "GET" and len(parts) == 1 and parts[0] in collections:
+            return 200, self.send(200, json.dumps(self.page(collections[parts[0]], query)))
+        if len(parts) == 3 and parts[0] == "campaigns" and parts[1] in ("inbound_campaigns", "outbound_campaigns", "autodial_campaigns"):
+            if method == "GET":
+                return 200, self.send(200, json.dumps(domain.campaign_definition(parts[2])))
+            if method == "PUT":
+                definition = domain.campaign_definition(parts[2])
+                definition.update(json.loads(body))
+                with domain.lock:
+                    domain.campaign_definitions[parts[2]] = definition
+                return 200, self.send(200, "{}")
+        if method == "PUT" and len(parts) == 2 and parts[0] == "skills":
+            json.loads(body)
+            return 200, self.send(200, "{}")
+        if method == "POST" and len(parts) == 1 and parts[0] in domain.created:
+            created = json.loads(body)
+            with domain.lock:
+                domain.created[parts[0]].append(created)
+                if parts[0] == "contact-fields":
+                    domain.call_variables.append({"id": str(400000 + len(domain.call_variables)), "fullName": f"Customer.{created['name']}"})
+            return 200, self.send(200, json.dumps({"id": str(len(domain.created[parts[0]]))}))
+        return 404, self.send(404, "{}")
+
+    #SOAP
+    def soap_fault(self, message):
+        return 500, self.send(500, SOAP_ENVELOPE.format(SOAP_FAULT.format(escape(message))), "text/xml;charset=UTF-8")
+
+    def handle_soap(self, operation, body):
+        try:
+            envelope = etree.fromstring(body, etree.XMLParser(huge_tree=True))
+        except etree.XMLSyntaxError as e:
+            return self.soap_fault(f"Invalid request: {e}")
+        if operation == "SOAP getVCCConfiguration":
+            result = (f'<ns2:getVCCConfigurationResponse xmlns:ns2="http://service.admin.ws.five9.com/"><return>'
+                      f'<domainId>{DOMAIN_ID}</domainId><domainName>{DOMAIN_NAME}</domainName></return></ns2:getVCCConfigurationResponse>')
+            return 200, self.send(200, SOAP_ENVELOPE.format(result), "text/xml;charset=UTF-8")
+        if operation == "SOAP getIVRScripts":
+            pattern = envelope.findtext(".//namePattern") or ".*"
+            try:
+                names = [name for name in self.domain.scripts if re.fullmatch(pattern, name)]
+            except re.error as e:
+                return self.soap_fault(f"Invalid name pattern: {e}")
+            parts = [b'<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/"><env:Header/><env:Body>'
+                     b'<ns2:getIVRScriptsResponse xmlns:ns2="http://service.admin.ws.five9.com/">']
+            for name in names:
+                parts.append(f"<return><description/><name>{escape(name)}</name><xmlDefinition>".encode("utf-8"))
+                parts.append(escape(self.domain.script_xml(name).decode("utf-8")).encode("utf-8"))
+                parts.append(b"</xmlDefinition></return>")
+            parts.append(b"</ns2:getIVRScriptsResponse></env:Body></env:Envelope>")
+            return 200, self.send(200, b"".join(parts), "text/xml;charset=UTF-8")
+        if operation == "SOAP modifyIVRScript":
+            name = envelope.findtext(".//scriptDef/name")
+            definition = (envelope.findtext(".//scriptDef/xmlDefinition") or "").strip()
+            if name not in self.domain.scripts:
+                return self.soap_fault(f"Script {name} not found")
+            try:
+                etree.fromstring(definition.encode("utf-8"), etree.XMLParser(huge_tree=True))
+            except etree.XMLSyntaxError as e:
+                return self.soap_fault(f"Invalid script definition: {e}")
+            with self.domain.lock:
+                self.domain.script_definitions[name] = zlib.compress(definition.encode("utf-8"))
+            result = '<ns2:modifyIVRScriptResponse xmlns:ns2="http://service.admin.ws.five9.com/"/>'
+            return 200, self.send(200, SOAP_ENVELOPE.format(result), "text/xml;charset=UTF-8")
+        return self.soap_fault(f"Unsupported operation {operation}")
+
+def serve(port, domain, options, host="127.0.0.1"):
+    """starts the mock api and blocks until interrupted"""
+    handler = type("Handler", (MockFive9Handler,), {"domain": domain, "stats": Stats(), "options": options})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Five9 admin APIs")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--ivrs", type=int, default=100, help="Number of ivr scripts in the domain")
+    parser.add_argument("--modules", type=int, default=200, help="Number of modules in each ivr script")
+    parser.add_argument("--skills", type=int, default=500, help="Number of skills, each has a whisper prompt")
+    parser.add_argument("--campaigns", type=int, default=150, help="Number of campaigns, four in five are inbound")
+    parser.add_argument("--latency", type=float, default=0.0, help="Average seconds added to every REST response")
+    parser.add_argument("--soap-latency", type=float, default=0.0, help="Average seconds added to every SOAP response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle", type=int, default=0, help="Concurrent requests allowed before answering 429, 0 disables")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--no-compression", default=False, action="store_true", help="Never compresses responses")
+    parser.add_argument("--reject-compressed", default=False, action="store_true",
+                        help="Ignores Content-Encoding on requests, like a server without request decompression")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+if __name__ == "__main__":
+    options = parse_args()
+    domain = MockDomain(options.ivrs, options.modules, options.skills, options.campaigns, options.seed)
+    print(f"Mock Five9 API listening on http://127.0.0.1:{options.port}", flush=True)
+    try:
+        serve(options.port, domain, options)
+    except KeyboardInterrupt:
+        pass
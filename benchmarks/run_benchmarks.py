@@ -0,0 +1,251 @@
+"""
+Purpose: Measures the CLI commands against the local mock of the Five9 APIs (mock_five9.py).
+
+Every scenario runs app.py in a fresh process with an empty cache directory and its own working directory, then reports
+wall time, peak memory of the app process, requests per second and the server side latency percentiles of each
+operation.
+
+Usage:
+    python benchmarks/run_benchmarks.py                              #small domain, every scenario
+    python benchmarks/run_benchmarks.py --scale realistic -s "ivr -c"  #1k ivrs with 2k modules each, 5k skills
+    python benchmarks/run_benchmarks.py --json results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --fail-on-regression 0.2
+    python benchmarks/run_benchmarks.py -s startup                   #startup time only, no mock server needed
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(os.path.dirname(HERE), "app.py")
+MOCK = os.path.join(HERE, "mock_five9.py")
+
+SCALES = {
+    "small": {"ivrs": 50, "modules": 200, "skills": 200, "campaigns": 100},
+    "medium": {"ivrs": 200, "modules": 1000, "skills": 1000, "campaigns": 500},
+    "realistic": {"ivrs": 1000, "modules": 2000, "skills": 5000, "campaigns": 1500},
+}
+SCENARIOS = {
+    #name -> (app.py arguments, text sent to stdin)
+    "ivr -c": (["ivr", "-c"], None),
+    "ivr -av": (["ivr", "-av", "string:BenchVariable"], None),
+    "whisper": (["whisper"], "\n"),
+    "campaign -p": (["campaign", "-p", "benchParameter:1"], None),
+    "troubleshoot --audio": (["troubleshoot", "--audio"], None),
+}
+
+STARTUP = "startup"
+STARTUP_RUNS = 10 #Number of times app.py --help is timed, the median is reported
+STARTUP_DEFERRED = ("requests", "urllib3", "lxml.etree", "xmltodict", "dotenv") #Must not be imported just to show --help
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def call_mock(port, path, method="GET"):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+def start_mock(port, options) -> subprocess.Popen:
+    """starts mock_five9.py and waits until it accepts requests"""
+    args = [sys.executable, MOCK, "--port", str(port)]
+    for key, value in options.items():
+        if value is True:
+            args.append(f"--{key.replace('_', '-')}")
+        elif value is not False:
+            args += [f"--{key.replace('_', '-')}", str(value)]
+    mock = subprocess.Popen(args, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            call_mock(port, "/__stats")
+            return mock
+        except OSError:
+            time.sleep(0.1)
+    mock.kill()
+    raise RuntimeError("mock server did not start")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def run_scenario(name, port, timeout) -> dict:
+    """runs a single scenario against a freshly reset mock domain and returns its measurements"""
+    args, stdin = SCENARIOS[name]
+    call_mock(port, "/__reset?data=1", "POST")
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, USERPROFILE=home, **{
+            "VCC-REST-URL": f"http://127.0.0.1:{port}/restadmin/api/v1/domains",
+            "VCC-SOAP-URL": f"http://127.0.0.1:{port}/wsadmin/v12/AdminWebService",
+            "VCC-Username": "bench", "VCC-Password": "bench"})
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, APP] + args, cwd=home, env=env, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if stdin:
+            process.stdin.write(stdin.encode())
+        process.stdin.close()
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        #os.wait4 reports the peak resident memory of the child, read stdout first so it never blocks on a full pipe
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        timer.cancel()
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+    stats = call_mock(port, "/__stats")
+
+    operations = defaultdict(list)
+    statuses = defaultdict(int)
+    sent = received = 0
+    for operation, code, seconds, bytes_in, bytes_out in stats["requests"]:
+        operations[operation].append(seconds)
+        statuses[str(code)] += 1
+        received += bytes_in
+        sent += bytes_out
+    result = {
+        "scenario": name,
+        "exit_code": process.returncode,
+        "timed_out": wall >= timeout,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1), #ru_maxrss is in kilobytes on linux
+        "requests": len(stats["requests"]),
+        "requests_per_second": round(len(stats["requests"]) / wall, 1) if wall else 0,
+        "peak_concurrency": stats["peak_in_flight"],
+        "bytes_sent_by_app": received,
+        "bytes_received_by_app": sent,
+        "statuses": dict(statuses),
+        "operations": {operation: {"count": len(values),
+                                   "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                                   "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                                   "p99_ms": round(percentile(values, 0.99) * 1000, 2)}
+                       for operation, values in sorted(operations.items())},
+    }
+    if process.returncode != 0:
+        result["output_tail"] = output.decode(errors="replace")[-2000:]
+    return result
+
+def run_startup(runs=STARTUP_RUNS) -> dict:
+    """times python app.py --help and checks that it does not import the dependencies commands load on demand"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, APP, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    #-X importtime lists every module imported, with the cumulative microseconds of each on the last column
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=os.path.dirname(APP),
+                           capture_output=True, text=True)
+    imported = {}
+    for line in trace.stderr.splitlines():
+        columns = line.split("|")
+        if len(columns) == 3 and columns[1].strip().isdigit():
+            imported[columns[2].strip()] = int(columns[1])
+    deferred = [module for module in STARTUP_DEFERRED if module in imported]
+    return {
+        "scenario": STARTUP,
+        "exit_code": process.returncode or trace.returncode or (1 if deferred else 0),
+        "wall_seconds": round(percentile(times, 0.5), 4),
+        "fastest_seconds": round(min(times), 4),
+        "import_ms": round(imported.get("app", 0) / 1000, 1),
+        "eagerly_imported": deferred,
+    }
+
+def print_result(result, baseline=None):
+    before = (baseline or {}).get(result["scenario"])
+    change = ""
+    if before:
+        change = f" ({(result['wall_seconds'] - before['wall_seconds']) / before['wall_seconds']:+.0%} vs baseline)"
+    print(f"\n{result['scenario']}: {result['wall_seconds']}s{change}, exit code {result['exit_code']}")
+    if result["scenario"] == STARTUP:
+        print(f"  app.py --help median of {STARTUP_RUNS} runs, fastest {result['fastest_seconds']}s, import app {result['import_ms']}ms")
+        if result["eagerly_imported"]:
+            print(f"  Error: {', '.join(result['eagerly_imported'])} imported at startup")
+        return
+    print(f"  {result['requests']} requests, {result['requests_per_second']} req/s, peak concurrency {result['peak_concurrency']}, "
+          f"peak memory {result['peak_rss_mb']} MB")
+    print(f"  {result['bytes_sent_by_app'] / 1e6:.1f} MB sent, {result['bytes_received_by_app'] / 1e6:.1f} MB received, statuses {result['statuses']}")
+    for operation, summary in result["operations"].items():
+        print(f"  {operation:<45} {summary['count']:>7}  p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  p99 {summary['p99_ms']:>8.2f}ms")
+    if "output_tail" in result:
+        print("  output:\n    " + result["output_tail"].replace("\n", "\n    "))
+
+def regressions(results, baseline, threshold):
+    """returns the scenarios whose wall time grew by more than threshold compared to the baseline"""
+    slower = []
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if before and result["wall_seconds"] > before["wall_seconds"] * (1 + threshold):
+            slower.append(result["scenario"])
+    return slower
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmarks app.py against a local mock of the Five9 APIs")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Size of the synthetic domain")
+    parser.add_argument("--scenario", "-s", action="append", choices=[STARTUP, *SCENARIOS], help="Scenario to run, may be repeated. Default: all")
+    parser.add_argument("--latency", type=float, default=0.02, help="Average seconds added to every REST response")
+    parser.add_argument("--soap-latency", type=float, default=0.05, help="Average seconds added to every SOAP response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle", type=int, default=0, help="Concurrent requests the mock allows before answering 429")
+    parser.add_argument("--no-compression", default=False, action="store_true", help="The mock never compresses responses")
+    parser.add_argument("--reject-compressed", default=False, action="store_true", help="The mock rejects compressed request bodies")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds a scenario may run before it is reported as timed out")
+    parser.add_argument("--json", dest="json_path", help="Writes the results to this file")
+    parser.add_argument("--baseline", help="Results file from an earlier run to compare against")
+    parser.add_argument("--fail-on-regression", type=float, default=None, metavar="FRACTION",
+                        help="Exits with 1 when a scenario is slower than the baseline by more than this fraction")
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args)
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+    mock_options = dict(SCALES[options.scale], latency=options.latency, soap_latency=options.soap_latency,
+                        error_rate=options.error_rate, throttle=options.throttle,
+                        no_compression=options.no_compression, reject_compressed=options.reject_compressed)
+    scenarios = options.scenario or [STARTUP, *SCENARIOS]
+    results = []
+    if STARTUP in scenarios:
+        results.append(run_startup())
+        print_result(results[-1], baseline)
+    scenarios = [name for name in scenarios if name != STARTUP]
+    if scenarios:
+        port = free_port()
+        mock = start_mock(port, mock_options)
+        try:
+            for name in scenarios:
+                result = run_scenario(name, port, options.timeout)
+                results.append(result)
+                print_result(result, baseline)
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    if options.json_path:
+        with open(options.json_path, "w") as f:
+            json.dump({"scale": options.scale, "mock": mock_options, "results": results}, f, indent=2)
+    failed = [result["scenario"] for result in results if result["exit_code"] != 0]
+    if failed:
+        print(f"\nError: {', '.join(failed)} exited with an error")
+    if baseline and options.fail_on_regression is not None:
+        slower = regressions(results, baseline, options.fail_on_regression)
+        if slower:
+            print(f"\nError: {', '.join(slower)} regressed by more than {options.fail_on_regression:.0%}")
+            return 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())